@@ -1,19 +1,28 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Conditional HTTP cache for scraper JSON (ORPH_HTTP_CACHE_MODE=replay to rebuild offline)
+export ORPH_HTTP_CACHE="${ORPH_HTTP_CACHE:-data/cache/http}"
+
 # TEXT SOURCES
-python -m src.data_prep.scrapers.pubmed --out data/raw/pubmed --term "randomized controlled trial[pt] OR review[pt]" --mindate 2018
-python -m src.data_prep.scrapers.clinicaltrials --out data/raw/clinicaltrials --expr "(asthma OR diabetes OR hypertension)"
+python -m src.data_prep.scrapers.pubmed --out data/raw/pubmed --mode efetch --term "randomized controlled trial[pt] OR review[pt]" --mindate 2018
+python -m src.data_prep.scrapers.clinicaltrials --out data/raw/clinicaltrials --expr "(asthma OR diabetes OR hypertension)" --since last
 python -m src.data_prep.scrapers.openfda_labels --out data/raw/openfda/labels --max_docs 2000
 python -m src.data_prep.scrapers.dailymed --out data/raw/dailymed --max_docs 500
 
+# FILTER (orph.yaml data policy: licenses, min length, languages)
+python -m src.data_prep.cleaners.quality_filter \
+  --inputs data/raw/pubmed data/raw/clinicaltrials data/raw/openfda/labels data/raw/dailymed \
+  --out data/filtered/text
+
 # MERGE
 python -m src.data_prep.merge.dataset_merger \
-  --inputs data/raw/pubmed data/raw/clinicaltrials data/raw/openfda/labels data/raw/dailymed \
-  --out data/cleaned/text_corpus.jsonl
+  --inputs data/filtered/text \
+  --out data/cleaned/text_corpus
 
 # RAG
-python -m src.rag.index_builder "data/cleaned/text_corpus.jsonl" -- out_dir data/artifacts/rag
+python -m src.rag.index_builder data/cleaned/text_corpus --out_dir data/artifacts/rag
 
 # TOKENIZER
-python -m src.tokenizer.train_tokenizer --jsonl data/cleaned/text_corpus.jsonl --out_dir data/artifacts/tokenizer --vocab_size 48000
+python -m src.tokenizer.train_tokenizer --jsonl data/cleaned/text_corpus --out_dir data/artifacts/tokenizer --vocab_size 48000
+python -m src.tokenizer.encode_corpus --inputs data/cleaned/text_corpus --model data/artifacts/tokenizer/orph_spm.model --out_dir data/artifacts/tokens
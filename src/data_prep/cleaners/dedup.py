@@ -1,50 +1,265 @@
-import argparse, os
+import argparse, os, json, pickle, sqlite3, hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Optional, List, Dict, Any
+import numpy as np
 from datasketch import MinHash, MinHashLSH
-from src.utils.io import read_jsonl, write_jsonl, ensure_dir
+from src.utils.io import (read_jsonl, list_jsonl, open_text, ensure_dir, save_json, save_json_atomic, load_json,
+                          content_digest)
+from src.data_prep.cleaners.text_clean import normalize_text
 from src.utils.logger import get_logger
 from rapidfuzz.utils import default_process
 log = get_logger("dedup")
 
-def shingles(text: str, n=5):
+# ---- vectorized MinHash signatures ----
+# Universal hashing as in datasketch's original scheme: (a*h + b) mod p, masked to 32 bits.
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_POLY = np.uint64(1099511628211)
+_BLOCK = 4096  # shingles per permutation block (bounds the (block, num_perm) matrix)
+_PERMS: Dict[tuple, tuple] = {}
+
+def _permutations(num_perm: int, seed: int = 1):
+    k = (num_perm, seed)
+    if k not in _PERMS:
+        gen = np.random.RandomState(seed)
+        a = gen.randint(1, int(_MERSENNE), num_perm, dtype=np.uint64)
+        b = gen.randint(0, int(_MERSENNE), num_perm, dtype=np.uint64)
+        _PERMS[k] = (a, b)
+    return _PERMS[k]
+
+def _fmix64(h: np.ndarray) -> np.ndarray:
+    h ^= h >> np.uint64(33); h *= np.uint64(0xff51afd7ed558ccd)
+    h ^= h >> np.uint64(33); h *= np.uint64(0xc4ceb9fe1a85ec53)
+    h ^= h >> np.uint64(33)
+    return h
+
+def shingle_hashes(text: str, n=5) -> np.ndarray:
+    """Unique 32-bit hashes of the character n-grams of default_process(text), no Python loop per shingle."""
     s = default_process(text or "")
-    return {s[i:i+n] for i in range(max(0, len(s)-n+1))}
+    if len(s) < n:
+        return np.empty(0, dtype=np.uint64)
+    cp = np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    win = np.lib.stride_tricks.sliding_window_view(cp, n)
+    with np.errstate(over="ignore"):
+        h = np.zeros(len(win), dtype=np.uint64)
+        for j in range(n):  # polynomial rolling hash, wraps mod 2^64
+            h = h * _POLY + win[:, j]
+        h = _fmix64(h)
+    return np.unique(h & _MAX_HASH)
+
+def signature(text: str, num_perm=128, n=5, seed=1) -> Optional[np.ndarray]:
+    """MinHash signature (uint64[num_perm]) of a text's shingle set; None if it has no shingles."""
+    hv = shingle_hashes(text, n)
+    if not len(hv):
+        return None
+    a, b = _permutations(num_perm, seed)
+    sig = np.full(num_perm, _MAX_HASH, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i in range(0, len(hv), _BLOCK):
+            phv = (hv[i:i + _BLOCK, None] * a + b) % _MERSENNE & _MAX_HASH
+            np.minimum(sig, phv.min(axis=0), out=sig)
+    return sig
+
+def _sign_batch(args) -> List[Optional[np.ndarray]]:
+    texts, num_perm, n, seed = args
+    return [signature(t, num_perm, n, seed) if t else None for t in texts]
+
+def _as_minhash(sig: np.ndarray) -> MinHash:
+    try:
+        return MinHash(num_perm=len(sig), hashvalues=sig, scheme="legacy")
+    except TypeError:  # datasketch < 2.0 has no `scheme`
+        return MinHash(num_perm=len(sig), hashvalues=sig)
 
 def minhash(text: str, num_perm=128):
-    m = MinHash(num_perm=num_perm)
-    for g in shingles(text, n=5):
-        m.update(g.encode("utf-8"))
-    return m
-
-def dedup(in_path: str, out_path: str, threshold=0.85, num_perm=128):
-    ensure_dir(os.path.dirname(out_path))
-    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
-    kept, idx = [], 0
-    mh_store = []
-
-    for r in read_jsonl(in_path):
-        txt = r.get("text","")
-        if not txt:
-            kept.append(r); continue
-        m = minhash(txt, num_perm=num_perm)
-        # Query near-dups
-        hits = lsh.query(m)
-        if hits:
-            continue
-        name = f"m{idx}"; idx += 1
-        lsh.insert(name, m); mh_store.append((name, m))
-        kept.append(r)
-
-        if idx % 5000 == 0:
-            log.info(f"Processed {idx} items; kept={len(kept)}")
-
-    write_jsonl(out_path, kept)
-    log.info(f"Dedup done. Input→Output: ? → {len(kept)} rows.")
+    sig = signature(text, num_perm)
+    return _as_minhash(sig if sig is not None else np.full(num_perm, _MAX_HASH, dtype=np.uint64))
+
+# ---- exact / normalized-hash prefilter ----
+def exact_key(text: str) -> int:
+    """64-bit blake2b of the whitespace- and case-normalized text (as a signed int for SQLite)."""
+    d = hashlib.blake2b(normalize_text(text).casefold().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(d, "little", signed=True)
+
+class ExactHashSet:
+    """
+    Set of 64-bit keys in an SQLite rowid table (8 bytes + B-tree overhead per key, paged from
+    disk, so it scales past RAM). path=None keeps it in memory. Changes become durable on commit().
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.db = sqlite3.connect(path or ":memory:")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS h (k INTEGER PRIMARY KEY)")
+
+    def add(self, key: int) -> bool:
+        """True if the key was new."""
+        return self.db.execute("INSERT OR IGNORE INTO h VALUES (?)", (key,)).rowcount == 1
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM h").fetchone()[0]
+
+    def commit(self) -> None:
+        self.db.commit()
+
+# ---- persistent index ----
+class DedupIndex:
+    """
+    MinHashLSH over everything admitted so far, persisted as `<dir>/lsh.pkl` + `<dir>/index.json`
+    (params, key counter, content digests of the input files already indexed), plus the
+    exact-hash set in `<dir>/exact.sqlite`. Inputs are identified by content, so a shard rewritten
+    with the same rows is skipped and one with new rows is processed, whatever its name or mtime. Reopening it lets a new shard be deduplicated against the whole
+    corpus without re-signing the corpus.
+    """
+    def __init__(self, path: Optional[str], threshold=0.85, num_perm=128, shingle=5, seed=1):
+        self.path = path
+        self.params = {"threshold": threshold, "num_perm": num_perm, "shingle": shingle, "seed": seed,
+                       "hash": "poly64-fmix/universal32"}
+        self.meta: Dict[str, Any] = {"params": self.params, "n_keys": 0, "inputs": {}}
+        self.lsh = None
+        if path and os.path.exists(os.path.join(path, "index.json")):
+            meta = load_json(os.path.join(path, "index.json"))
+            if meta.get("params") != self.params:
+                raise ValueError(f"Index at {path} was built with {meta.get('params')}, not {self.params}")
+            with open(os.path.join(path, "lsh.pkl"), "rb") as f:
+                self.lsh = pickle.load(f)
+            self.meta = meta
+            log.info(f"[dedup] loaded index {path}: {meta['n_keys']} keys, {len(meta['inputs'])} inputs")
+        if self.lsh is None:
+            self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        if path:
+            ensure_dir(path)
+        self.exact = ExactHashSet(os.path.join(path, "exact.sqlite") if path else None)
+
+    def indexed(self, path: str) -> bool:
+        return content_digest(path) in self.meta["inputs"]
+
+    def mark_indexed(self, path: str) -> None:
+        self.meta["inputs"][content_digest(path)] = os.path.abspath(path)
+
+    def admit(self, sig: np.ndarray) -> bool:
+        """Insert unless a near-duplicate is already indexed; True if admitted."""
+        m = _as_minhash(sig)
+        if self.lsh.query(m):
+            return False
+        self.lsh.insert(f"m{self.meta['n_keys']}", m, check_duplication=False)
+        self.meta["n_keys"] += 1
+        return True
+
+    def save(self) -> None:
+        self.exact.commit()
+        if not self.path:
+            return
+        ensure_dir(self.path)
+        p = os.path.join(self.path, "lsh.pkl")
+        with open(p + ".tmp", "wb") as f:
+            pickle.dump(self.lsh, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(p + ".tmp", p)
+        save_json_atomic(os.path.join(self.path, "index.json"), self.meta)
+
+def dedup(in_path: str, out_path: str, threshold=0.85, num_perm=128, index_dir: Optional[str] = None,
+          workers: int = 1, batch: int = 512, exact: bool = True, report_path: Optional[str] = None):
+    """
+    Streaming duplicate removal over a JSONL file or shard dir, in two stages:
+      1. exact: main process drops rows whose normalized text hash is already in the set;
+      2. near:  survivors are MinHash-signed in `workers` processes (~2 batches each in flight)
+                and queried/inserted into the LSH in input order.
+    Every admitted row is written immediately. With `index_dir`, both indexes are loaded first
+    and saved after, input files already indexed are skipped, and `out_path` is appended to: it
+    holds every row admitted into the index over all runs (rows of a re-processed input that were
+    kept before count as exact duplicates of themselves). Without an index it is rewritten.
+    Per-stage counts of this run, overall and per meta.source, go to `report_path` (default:
+    dedup_report.json next to the output).
+    """
+    ensure_dir(os.path.dirname(out_path) or ".")
+    index = DedupIndex(index_dir, threshold, num_perm)
+    out_key = os.path.abspath(out_path)
+    committed = index.meta.setdefault("outputs", {}).get(out_key)
+    if index_dir and committed is not None and os.path.exists(out_path) and os.path.getsize(out_path) > committed:
+        # rows appended by a run that died before saving the index: drop them, they are redone
+        with open(out_path, "ab") as f:
+            f.truncate(committed)
+    inputs = []
+    for p in list_jsonl(in_path):
+        if index.indexed(p):
+            log.info(f"[dedup] skip {p}: already in index")
+        else:
+            inputs.append(p)
+    rows = (r for p in inputs for r in read_jsonl(p))
+    report: Dict[str, Any] = {"input": 0, "exact_dup": 0, "near_dup": 0, "kept": 0, "by_source": {}}
+
+    def count(r, stage):
+        src = (r.get("meta") or {}).get("source", "unknown")
+        st = report["by_source"].setdefault(src, {"input": 0, "exact_dup": 0, "near_dup": 0, "kept": 0})
+        for d in (report, st):
+            d["input"] += 1
+            d[stage] += 1
+
+    def batches():
+        # stage 1 runs here, so exact duplicates never reach the signing pool
+        while True:
+            b = list(islice(rows, batch))
+            if not b:
+                return
+            keep = [not (exact and r.get("text") and not index.exact.add(exact_key(r["text"]))) for r in b]
+            yield b, keep, ([r.get("text", "") for r, k in zip(b, keep) if k], num_perm, 5, 1)
+
+    ex = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending: deque = deque()
+    it = batches()
+    try:
+        with open_text(out_path, "at" if index_dir else "wt") as out:
+            while True:
+                if ex is not None:
+                    while len(pending) < 2 * workers:
+                        nb = next(it, None)
+                        if nb is None:
+                            break
+                        pending.append((nb[0], nb[1], ex.submit(_sign_batch, nb[2])))
+                    if not pending:
+                        break
+                    b, keep, fut = pending.popleft()
+                    sigs = iter(fut.result())
+                else:
+                    nb = next(it, None)
+                    if nb is None:
+                        break
+                    b, keep, sigs = nb[0], nb[1], iter(_sign_batch(nb[2]))
+                for r, k in zip(b, keep):
+                    if not k:
+                        count(r, "exact_dup")
+                        continue
+                    sig = next(sigs)
+                    # rows without shingles (empty/very short text) are kept, as before
+                    if sig is None or index.admit(sig):
+                        out.write(json.dumps(r, ensure_ascii=False) + "\n")
+                        count(r, "kept")
+                    else:
+                        count(r, "near_dup")
+                    if report["input"] % 5000 == 0:
+                        log.info(f"Processed {report['input']} items; kept={report['kept']}")
+    finally:
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+    for p in inputs:
+        index.mark_indexed(p)
+    index.meta["outputs"][out_key] = os.path.getsize(out_path)
+    index.save()
+    save_json(report_path or os.path.join(os.path.dirname(out_path) or ".", "dedup_report.json"), report)
+    log.info(f"Dedup done. Input→Output: {report['input']} → {report['kept']} rows "
+             f"(exact={report['exact_dup']}, near={report['near_dup']}).")
+    return report
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("--in_path", required=True)
+    ap.add_argument("--in_path", required=True, help="JSONL file or shard directory")
     ap.add_argument("--out_path", required=True)
     ap.add_argument("--threshold", type=float, default=0.85)
     ap.add_argument("--num_perm", type=int, default=128)
+    ap.add_argument("--index_dir", default=None, help="Persistent LSH index to dedup against and extend")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=512)
+    ap.add_argument("--no_exact", dest="exact", action="store_false", help="Skip the exact-hash prefilter")
+    ap.add_argument("--report_path", default=None)
     args = ap.parse_args()
     dedup(**vars(args))
@@ -1,7 +1,147 @@
-from PIL import Image
+import argparse, os, json
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple
+import numpy as np
+from PIL import Image, ImageFile
+from src.utils.io import read_jsonl, list_jsonl, ShardWriter, save_json, ensure_dir
+from src.utils.logger import get_logger
+log = get_logger("image_qc")
+
+ImageFile.LOAD_TRUNCATED_IMAGES = False  # truncated files must fail the decode check
+
 def valid_image(path: str, min_w=256, min_h=256):
     try:
         im = Image.open(path); w,h = im.size
         return (w>=min_w and h>=min_h)
     except Exception:
         return False
+
+# ---- perceptual hash (DCT pHash, 64 bit) ----
+_N, _K = 32, 8
+_DCT = np.cos(np.pi / _N * (np.arange(_N)[:, None] * (np.arange(_N)[None, :] + 0.5)))
+
+def phash(im: Image.Image) -> int:
+    g = np.asarray(im.convert("L").resize((_N, _N), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ g @ _DCT.T)[:_K, :_K].flatten()
+    bits = low > np.median(low[1:])  # DC term excluded from the median
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def check_image(path: str, min_w: int = 256, min_h: int = 256) -> Tuple[Optional[str], Optional[int], int, int]:
+    """(reject reason or None, phash, width, height) after a full decode."""
+    if not path or not os.path.exists(path):
+        return "missing", None, 0, 0
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+            if w < min_w or h < min_h:
+                return "low_resolution", None, w, h
+            im.load()  # real decode: raises on truncated/corrupt data
+            return None, phash(im), w, h
+    except Exception:
+        return "corrupt", None, 0, 0
+
+def _check_batch(args) -> List[Tuple[Optional[str], Optional[int], int, int]]:
+    paths, min_w, min_h = args
+    return [check_image(p, min_w, min_h) for p in paths]
+
+class BKTree:
+    """Hamming-distance BK-tree over 64-bit hashes; find() returns any item within `radius`."""
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, payload, {dist: child}]
+
+    def add(self, h: int, payload: Any) -> None:
+        if self.root is None:
+            self.root = [h, payload, {}]; return
+        node = self.root
+        while True:
+            d = bin(h ^ node[0]).count("1")
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, payload, {}]; return
+            node = child
+
+    def find(self, h: int, radius: int) -> Optional[Any]:
+        if self.root is None:
+            return None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = bin(h ^ node[0]).count("1")
+            if d <= radius:
+                return node[1]
+            for k, child in node[2].items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        return None
+
+def run_qc(inputs: List[str], out_dir: str, min_res=(256, 256), max_distance: int = 6,
+           workers: int = 1, batch: int = 256, shard_size: int = 50000) -> Dict[str, Any]:
+    """
+    Image QC over schema v2 manifests (rows with image_path): decode check + min resolution
+    across a process pool, then pHash near-duplicate removal (first occurrence wins) in input
+    order. Writes kept rows as shards (replacing a previous run's), dropped rows to
+    reports/qc_dropped.jsonl (outside the shard listing, so readers of out_dir only see kept
+    rows) and qc_report.json.
+    """
+    drop_path = os.path.join(out_dir, "reports", "qc_dropped.jsonl")
+    ensure_dir(os.path.dirname(drop_path))
+    paths = [p for i in inputs for p in list_jsonl(i)]
+    rows = (r for p in paths for r in read_jsonl(p))
+    tree = BKTree()
+    report: Dict[str, Any] = {"input": 0, "kept": 0, "dropped": {}, "by_source": {}}
+    ex = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def chunks():
+        while True:
+            block = list(islice(rows, batch * max(1, workers)))
+            if not block:
+                return
+            yield block
+
+    try:
+        with ShardWriter(out_dir, prefix="part", shard_size=shard_size, replace=True) as w, \
+             open(drop_path, "w", encoding="utf-8") as drop_f:
+            for block in chunks():
+                jobs = [([r.get("image_path") for r in block[i:i + batch]], min_res[0], min_res[1])
+                        for i in range(0, len(block), batch)]
+                results = [x for res in (ex.map(_check_batch, jobs) if ex else map(_check_batch, jobs)) for x in res]
+                for r, (reason, h, iw, ih) in zip(block, results):
+                    report["input"] += 1
+                    src = (r.get("meta") or {}).get("source", "unknown")
+                    st = report["by_source"].setdefault(src, {"input": 0, "kept": 0})
+                    st["input"] += 1
+                    dup_of = None
+                    if reason is None:
+                        dup_of = tree.find(h, max_distance)
+                        if dup_of is not None:
+                            reason = "near_duplicate"
+                    if reason is not None:
+                        report["dropped"][reason] = report["dropped"].get(reason, 0) + 1
+                        drop_f.write(json.dumps({"image_path": r.get("image_path"), "reason": reason,
+                                                 "duplicate_of": dup_of, "source": src}, ensure_ascii=False) + "\n")
+                        continue
+                    tree.add(h, r.get("image_path"))
+                    r.setdefault("meta", {}).update({"phash": f"{h:016x}", "width": iw, "height": ih})
+                    w.write(r)
+                    report["kept"] += 1
+                    st["kept"] += 1
+                log.info(f"[image_qc] {report['input']} checked, {report['kept']} kept")
+    finally:
+        if ex is not None:
+            ex.shutdown()
+    save_json(os.path.join(out_dir, "qc_report.json"), report)
+    log.info(f"[image_qc] done: {json.dumps(report)}")
+    return report
+
+if __name__ == "__main__":
+    from src.utils.config import load_config
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--inputs", nargs="+", required=True, help="Manifest JSONL files or shard dirs")
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--max_distance", type=int, default=6, help="pHash Hamming radius for near-duplicates")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=256)
+    args = ap.parse_args()
+    min_res = tuple(load_config().main.get("data", {}).get("image_min_resolution", [256, 256]))
+    run_qc(args.inputs, args.out, min_res, args.max_distance, args.workers, args.batch)
@@ -0,0 +1,140 @@
+import argparse, os, glob, json
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+from src.utils.io import read_jsonl, list_jsonl, ShardWriter, save_json, save_json_atomic, load_json
+from src.data_prep.cleaners.text_clean import normalize_text, detect_languages, load_lid
+from src.utils.logger import get_logger
+log = get_logger("quality_filter")
+
+"""
+Enforces the orph.yaml data policy (data.allow_licenses, data.min_text_len, data.languages)
+on scraped shards before merge/dedup. Each input shard is filtered by one worker into its
+own `<source>.<shard>-NNNNN.jsonl.*` shards + manifest, so reruns skip finished shards whose
+input is unchanged (size + mtime), and outputs of inputs that no longer exist are removed.
+"""
+
+REASONS = ("license", "empty", "too_short", "language")
+
+def policy_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    data = cfg.get("data", {})
+    return {"min_text_len": int(data.get("min_text_len", 0)),
+            "languages": list(data.get("languages") or []),
+            "allow_licenses": list(data.get("allow_licenses") or [])}
+
+def _prefix(in_path: str) -> str:
+    name = os.path.basename(in_path).split(".")[0]
+    return f"{os.path.basename(os.path.dirname(os.path.abspath(in_path)))}.{name}"
+
+def _fingerprint(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def _remove_outputs(out_dir: str, prefix: str) -> None:
+    manifest = f"{prefix}.manifest.json"
+    for p in glob.glob(os.path.join(out_dir, f"{prefix}-*")) + glob.glob(os.path.join(out_dir, manifest)):
+        os.remove(p)
+
+def filter_rows(rows: List[Dict], policy: Dict[str, Any], counts: Dict[str, int]) -> List[Dict]:
+    """Normalize text and drop rows violating `policy`; language ID runs once per batch."""
+    allow = set(policy["allow_licenses"])
+    langs = set(policy["languages"])
+    survivors, texts = [], []
+    for r in rows:
+        meta = r.get("meta") or {}
+        if allow and meta.get("license") not in allow:
+            counts["license"] += 1; continue
+        text = r.get("text")
+        if text:
+            r["text"] = text = normalize_text(text)
+        if not text:
+            if r.get("image_path"):  # image rows carry no text to check
+                survivors.append(r); texts.append(None)
+            else:
+                counts["empty"] += 1
+            continue
+        if len(text) < policy["min_text_len"]:
+            counts["too_short"] += 1; continue
+        survivors.append(r); texts.append(text)
+    if langs:
+        idx = [i for i, t in enumerate(texts) if t]
+        detected = dict(zip(idx, detect_languages([texts[i] for i in idx])))
+        kept = []
+        for i, r in enumerate(survivors):
+            lang = detected.get(i)
+            if lang is not None and lang not in langs:
+                counts["language"] += 1; continue
+            if lang is not None:
+                r.setdefault("meta", {})["lang"] = lang
+            kept.append(r)
+        survivors = kept
+    return survivors
+
+def filter_shard(in_path: str, out_dir: str, policy: Dict[str, Any], batch: int = 1024,
+                 lid_model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Filter one input shard into `<prefix>-NNNNN` shards with `<prefix>.manifest.json` holding the
+    policy, input fingerprint and drop counts. A finished shard is skipped only if both the
+    policy and the input (e.g. rewritten by compact_shards) are unchanged.
+    """
+    prefix = _prefix(in_path)
+    manifest = f"{prefix}.manifest.json"
+    fingerprint = _fingerprint(in_path)
+    prev = load_json(os.path.join(out_dir, manifest), {})
+    if prev.get("complete") and prev.get("policy") == policy and prev.get("fingerprint") == fingerprint:
+        return prev["counts"]
+    _remove_outputs(out_dir, prefix)
+    load_lid(lid_model)
+    counts = {"input": 0, "kept": 0, **{k: 0 for k in REASONS}}
+    rows = read_jsonl(in_path)
+    with ShardWriter(out_dir, prefix=prefix, shard_size=100000, manifest=manifest) as w:
+        while True:
+            block = list(islice(rows, batch))
+            if not block:
+                break
+            counts["input"] += len(block)
+            for r in filter_rows(block, policy, counts):
+                w.write(r)
+                counts["kept"] += 1
+    w.manifest.update({"complete": True, "policy": policy, "counts": counts, "input": in_path,
+                       "fingerprint": fingerprint})
+    save_json_atomic(w.manifest_path, w.manifest)
+    return counts
+
+def run_filter(inputs: List[str], out_dir: str, policy: Dict[str, Any], workers: int = 1,
+               batch: int = 1024, lid_model: Optional[str] = None) -> Dict[str, Any]:
+    shards = [p for i in inputs for p in list_jsonl(i)]
+    for m in glob.glob(os.path.join(out_dir, "*.manifest.json")):
+        src = load_json(m, {}).get("input")
+        if src and not os.path.exists(src):  # input shard gone (re-crawled into fewer shards)
+            log.info(f"[quality_filter] removing output of deleted input {src}")
+            _remove_outputs(out_dir, os.path.basename(m)[: -len(".manifest.json")])
+    args = ([out_dir] * len(shards), [policy] * len(shards), [batch] * len(shards), [lid_model] * len(shards))
+    if workers == 1:
+        results = list(map(filter_shard, shards, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(filter_shard, shards, *args))
+    report: Dict[str, Any] = {"policy": policy, "total": {"input": 0, "kept": 0, **{k: 0 for k in REASONS}},
+                              "by_input": {}}
+    for path, c in zip(shards, results):
+        src = report["by_input"].setdefault(_prefix(path).split(".")[0], {k: 0 for k in c})
+        for k, v in c.items():
+            src[k] += v
+            report["total"][k] += v
+    save_json(os.path.join(out_dir, "filter_report.json"), report)
+    log.info(f"[quality_filter] {len(shards)} shards: {json.dumps(report['total'])}")
+    return report
+
+if __name__ == "__main__":
+    from src.utils.config import load_config
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--inputs", nargs="+", required=True, help="JSONL files or shard dirs")
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=1024)
+    ap.add_argument("--lid_model", default=None, help="fastText lid.176 model (default: data.lid_model / ORPH_LID_MODEL)")
+    args = ap.parse_args()
+    cfg = load_config().main
+    run_filter(args.inputs, args.out, policy_from_config(cfg), args.workers, args.batch,
+               args.lid_model or cfg.get("data", {}).get("lid_model"))
@@ -1,10 +1,71 @@
-import re
+import os, re
+from typing import List, Optional, Sequence
+from src.utils.logger import get_logger
+log = get_logger("text_clean")
+
+_WS_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"[^\W\d_]+")
+_ARABIC_RE = re.compile("[\u0600-\u06FF\u0750-\u077F]")
+_LATIN_RE = re.compile("[A-Za-z\u00C0-\u024F]")
 
 def normalize_text(s: str) -> str:
-    s = s.replace("\u00A0", " ").strip()
-    s = re.sub(r"\s+", " ", s)
-    return s
+    return _WS_RE.sub(" ", s.replace("\u00A0", " ")).strip()
+
+# ---- language ID ----
+# fastText lid.176 (.ftz/.bin) when available: ORPH_LID_MODEL or load_lid(path). Otherwise a
+# script + stopword heuristic that separates the languages we actually ingest.
+_STOPWORDS = {
+    "en": {"the", "and", "of", "to", "in", "is", "with", "for", "was", "were", "that", "by", "on", "are", "as"},
+    "fr": {"le", "la", "les", "et", "des", "du", "est", "une", "dans", "pour", "avec", "sur", "par"},
+    "de": {"der", "die", "das", "und", "ist", "mit", "von", "den", "bei", "nicht", "ein", "eine", "zu"},
+    "es": {"el", "los", "las", "y", "del", "es", "con", "una", "para", "por", "en", "que", "se"},
+    "pt": {"os", "as", "e", "do", "da", "com", "uma", "para", "por", "em", "que", "não", "dos"},
+}
+_LID_CHARS = 1000
+LID_URL = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.ftz"
+_lid = None
+_lid_warned = False
+
+def load_lid(path: Optional[str] = None):
+    """Load (once per process) a fastText language-ID model; None (with one warning) if unavailable."""
+    global _lid, _lid_warned
+    path = path or os.getenv("ORPH_LID_MODEL")
+    if _lid is not None:
+        return _lid
+    problem = None
+    if not path or not os.path.exists(path):
+        problem = f"model not found at {path!r} (data.lid_model / ORPH_LID_MODEL; download {LID_URL})"
+    else:
+        try:
+            import fasttext
+            _lid = fasttext.load_model(path)
+        except ImportError:
+            problem = "fasttext is not installed (pip install -r requirements.txt)"
+    if problem and not _lid_warned:
+        log.warning(f"Language ID falls back to the stopword heuristic: {problem}")
+        _lid_warned = True
+    return _lid
+
+def _heuristic_lang(s: str) -> str:
+    s = s[:_LID_CHARS]
+    arabic, latin = len(_ARABIC_RE.findall(s)), len(_LATIN_RE.findall(s))
+    if arabic > latin:
+        return "ar"
+    if not latin:
+        return "und"
+    words = _WORD_RE.findall(s.lower())
+    hits = {lang: sum(w in sw for w in words) for lang, sw in _STOPWORDS.items()}
+    best = max(hits, key=hits.get)
+    # terse records (labels, trial registries) often have no stopwords at all: Latin → en
+    return best if hits[best] > hits["en"] else "en"
+
+def detect_languages(texts: Sequence[str]) -> List[str]:
+    """ISO 639-1 code per text, one batched model call when fastText is loaded."""
+    model = load_lid()
+    if model is None:
+        return [_heuristic_lang(t or "") for t in texts]
+    labels, _ = model.predict([_WS_RE.sub(" ", (t or "")[:_LID_CHARS]) for t in texts], k=1)
+    return [l[0].replace("__label__", "") if l else "und" for l in labels]
 
 def is_language_ok(s: str, allow=("en",)):
-    # TODO: plug fastText langid; now naive
-    return True
+    return detect_languages([s])[0] in allow
@@ -1,56 +1,258 @@
-import json, os
+import json, os, pickle, argparse, threading
+from collections import OrderedDict
 from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
 from rapidfuzz import process, fuzz
+from rapidfuzz.utils import default_process
 
 _ART = os.path.join
 ROOT = "data/artifacts"
+MAPS = ("icd10", "snomed", "rxnorm", "meddra")
 
 def _load_map(path):
     if not os.path.exists(path): return {}
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def _best_keys(q: str, keys: list[str], limit=3, score_cutoff=86):
+    res = process.extract(q, keys, scorer=fuzz.WRatio, limit=limit, score_cutoff=score_cutoff)
+    return [k for k,score,idx in res]
+
+# ---- concept index ----
+_END = "\x00"  # terminal key in trie nodes; default_process never yields it as a token
+FUZZY_MIN_LEN = 6    # shorter tokens (abbreviations, numbers) must match exactly
+FUZZY_CUTOFF = 83    # fuzz.ratio; ~one edit in a 6-char token
+SHORT_QUERY = 4      # queries of <= this many tokens fall back to whole-string fuzzy matching
+
+def _tokens(s: str) -> List[str]:
+    return default_process(s or "").split()
+
+class ConceptIndex:
+    """
+    Token trie over the normalized surface forms of a {surface form: [codes]} map. find() makes
+    one left-to-right pass over a document (O(tokens x longest form)) and returns leftmost-longest
+    mentions; document tokens with no exact edge may match a trie token within FUZZY_CUTOFF.
+    Serialized as `<map>.index.pkl` next to the map JSON and rebuilt when the JSON changes.
+    """
+    VERSION = 1
+
+    def __init__(self, trie: Dict, buckets: Dict[Tuple[str, int], List[str]]):
+        self.trie = trie
+        self.buckets = buckets  # (first char, length) -> trie tokens, for the fuzzy fallback
+        self._fuzzy: Dict[str, Optional[str]] = {}
+
+    @classmethod
+    def build(cls, m: Dict[str, list]) -> "ConceptIndex":
+        trie: Dict = {}
+        vocab = set()
+        for key in m:
+            toks = _tokens(key)
+            if not toks:
+                continue
+            node = trie
+            for t in toks:
+                node = node.setdefault(t, {})
+            node.setdefault(_END, []).append(key)
+            vocab.update(toks)
+        buckets: Dict[Tuple[str, int], List[str]] = {}
+        for t in sorted(vocab):
+            if len(t) >= FUZZY_MIN_LEN:
+                buckets.setdefault((t[0], len(t)), []).append(t)
+        return cls(trie, buckets)
+
+    @classmethod
+    def load(cls, map_path: str, m: Optional[Dict[str, list]] = None) -> "ConceptIndex":
+        """Index for `map_path`, from its .index.pkl if that matches the JSON, else built (and saved)."""
+        idx_path = os.path.splitext(map_path)[0] + ".index.pkl"
+        stamp = None
+        if os.path.exists(map_path):
+            st = os.stat(map_path)
+            stamp = (cls.VERSION, st.st_size, st.st_mtime_ns)
+            try:
+                with open(idx_path, "rb") as f:
+                    saved = pickle.load(f)
+                if saved["stamp"] == stamp:
+                    return cls(saved["trie"], saved["buckets"])
+            except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+                pass
+        index = cls.build(_load_map(map_path) if m is None else m)
+        if stamp is not None:
+            index.save(idx_path, stamp)
+        return index
+
+    def save(self, idx_path: str, stamp) -> None:
+        tmp = f"{idx_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump({"stamp": stamp, "trie": self.trie, "buckets": self.buckets}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, idx_path)
+        except OSError:  # read-only artifacts dir: keep the in-memory index
+            pass
+
+    def _fuzzy_token(self, t: str) -> Optional[str]:
+        if len(t) < FUZZY_MIN_LEN:
+            return None
+        if t not in self._fuzzy:
+            if len(self._fuzzy) > 200_000:
+                self._fuzzy.clear()
+            cands = [c for n in (len(t) - 1, len(t), len(t) + 1) for c in self.buckets.get((t[0], n), ())]
+            hit = process.extractOne(t, cands, scorer=fuzz.ratio, score_cutoff=FUZZY_CUTOFF) if cands else None
+            self._fuzzy[t] = hit[0] if hit else None
+        return self._fuzzy[t]
+
+    def find(self, text: str, fuzzy: bool = True) -> List[Tuple[int, int, List[str]]]:
+        """(start token, end token, map keys) for each leftmost-longest mention."""
+        toks = _tokens(text)
+        out, i = [], 0
+        while i < len(toks):
+            node, j, best = self.trie, i, None
+            while j < len(toks):
+                nxt = node.get(toks[j])
+                if nxt is None and fuzzy:
+                    alt = self._fuzzy_token(toks[j])
+                    nxt = node.get(alt) if alt else None
+                if nxt is None:
+                    break
+                node, j = nxt, j + 1
+                if _END in node:
+                    best = (i, j, node[_END])
+            if best:
+                out.append(best)
+                i = best[1]
+            else:
+                i += 1
+        return out
+
 @lru_cache
-def _icd10():  return _load_map(_ART(ROOT, "icd10_map.json"))
-@lru_cache
-def _snomed(): return _load_map(_ART(ROOT, "snomed_map.json"))
+def _map(name: str) -> Dict[str, list]:
+    return _load_map(_ART(ROOT, f"{name}_map.json"))
+
 @lru_cache
-def _rxnorm(): return _load_map(_ART(ROOT, "rxnorm_map.json"))
+def _keys(name: str) -> List[str]:
+    return list(_map(name).keys())
+
 @lru_cache
-def _meddra(): return _load_map(_ART(ROOT, "meddra_map.json"))
+def _index(name: str) -> ConceptIndex:
+    return ConceptIndex.load(_ART(ROOT, f"{name}_map.json"), _map(name))
 
-def _best_keys(q: str, keys: list[str], limit=3, score_cutoff=86):
-    res = process.extract(q, keys, scorer=fuzz.WRatio, limit=limit, score_cutoff=score_cutoff)
-    return [k for k,score,idx in res]
+def _icd10():  return _map("icd10")
+def _snomed(): return _map("snomed")
+def _rxnorm(): return _map("rxnorm")
+def _meddra(): return _map("meddra")
 
-def map_icd10(text: str) -> list:
-    m = _icd10()
-    if not text: return []
-    keys = _best_keys(text, list(m.keys()))
+# ---- query cache ----
+QUERY_CACHE = 100_000   # entries per map
+CACHE_MAX_LEN = 256     # only short queries (names, terms) repeat; documents are not cached
+CDIST_CELLS = 1 << 26   # queries x vocabulary scores per cdist block (uint8 -> 64 MB)
+
+class _LRU:
+    def __init__(self, maxsize: int):
+        self.maxsize, self.data, self.lock = maxsize, OrderedDict(), threading.Lock()
+
+    def get(self, k):
+        with self.lock:
+            v = self.data.get(k)
+            if v is not None:
+                self.data.move_to_end(k)
+            return v
+
+    def put(self, k, v) -> None:
+        with self.lock:
+            self.data[k] = v
+            self.data.move_to_end(k)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+_cache = {name: _LRU(QUERY_CACHE) for name in MAPS}
+
+def _lookup(name: str, text: str) -> Optional[List[str]]:
+    """Map keys mentioned in `text`; None when a short query found nothing (needs the fuzzy scan)."""
+    keys = [k for _, _, ks in _index(name).find(text) for k in ks]
+    if not keys and len(_tokens(text)) <= SHORT_QUERY:
+        return None
+    return keys
+
+def _to_codes(m: Dict[str, list], keys) -> Tuple[str, ...]:
     out = []
     for k in keys: out.extend(m.get(k, []))
-    return sorted(set(out))
+    return tuple(sorted(set(out)))
+
+def _codes(name: str, text: str) -> list:
+    m = _map(name)
+    if not text or not m: return []
+    cacheable = len(text) <= CACHE_MAX_LEN
+    hit = _cache[name].get(text) if cacheable else None
+    if hit is None:
+        keys = _lookup(name, text)
+        hit = _to_codes(m, _best_keys(text, _keys(name)) if keys is None else keys)
+        if cacheable: _cache[name].put(text, hit)
+    return list(hit)
+
+def _codes_batch(name: str, texts: Sequence[str], workers: int = -1, limit=3, score_cutoff=86) -> List[list]:
+    """
+    _codes over many texts. Distinct queries are resolved once (LRU first, then the concept
+    index); the ones left for the fuzzy fallback are scored against the whole vocabulary in
+    process.cdist blocks on `workers` threads, keeping the top `limit` keys per query.
+    """
+    m = _map(name)
+    if not m:
+        return [[] for _ in texts]
+    resolved: Dict[str, Tuple[str, ...]] = {}
+    fuzzy: List[str] = []
+    for t in dict.fromkeys(t for t in texts if t):
+        hit = _cache[name].get(t) if len(t) <= CACHE_MAX_LEN else None
+        if hit is None:
+            keys = _lookup(name, t)
+            if keys is None:
+                fuzzy.append(t); continue
+            hit = _to_codes(m, keys)
+            if len(t) <= CACHE_MAX_LEN: _cache[name].put(t, hit)
+        resolved[t] = hit
+    vocab = _keys(name)
+    step = max(1, CDIST_CELLS // max(1, len(vocab)))
+    for i in range(0, len(fuzzy), step):
+        block = fuzzy[i:i + step]
+        scores = process.cdist(block, vocab, scorer=fuzz.WRatio, score_cutoff=score_cutoff,
+                               dtype=np.uint8, workers=workers)
+        for t, row in zip(block, scores):
+            cand = np.flatnonzero(row)
+            # same order as process.extract: score desc, then vocabulary order
+            top = cand[np.lexsort((cand, -row[cand].astype(np.int16)))][:limit]
+            hit = _to_codes(m, (vocab[j] for j in top))
+            if len(t) <= CACHE_MAX_LEN: _cache[name].put(t, hit)
+            resolved[t] = hit
+    return [list(resolved[t]) if t else [] for t in texts]
+
+def map_icd10(text: str) -> list:
+    return _codes("icd10", text)
 
 def map_snomed(text: str) -> list:
-    m = _snomed()
-    if not text: return []
-    keys = _best_keys(text, list(m.keys()))
-    out = []
-    for k in keys: out.extend(m.get(k, []))
-    return sorted(set(out))
+    return _codes("snomed", text)
 
 def map_rxnorm(drug_name: str) -> list:
-    m = _rxnorm()
-    if not drug_name: return []
-    keys = _best_keys(drug_name, list(m.keys()))
-    out = []
-    for k in keys: out.extend(m.get(k, []))
-    return sorted(set(out))
+    return _codes("rxnorm", drug_name)
 
 def map_meddra(text: str) -> list:
-    m = _meddra()
-    if not text: return []
-    keys = _best_keys(text, list(m.keys()))
-    out = []
-    for k in keys: out.extend(m.get(k, []))
-    return sorted(set(out))
+    return _codes("meddra", text)
+
+def map_icd10_batch(texts: Sequence[str], workers: int = -1) -> List[list]:
+    return _codes_batch("icd10", texts, workers)
+
+def map_snomed_batch(texts: Sequence[str], workers: int = -1) -> List[list]:
+    return _codes_batch("snomed", texts, workers)
+
+def map_rxnorm_batch(drug_names: Sequence[str], workers: int = -1) -> List[list]:
+    return _codes_batch("rxnorm", drug_names, workers)
+
+def map_meddra_batch(texts: Sequence[str], workers: int = -1) -> List[list]:
+    return _codes_batch("meddra", texts, workers)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="(Re)build the concept indexes next to the map JSONs")
+    ap.add_argument("--maps", nargs="+", default=list(MAPS), choices=MAPS)
+    args = ap.parse_args()
+    for name in args.maps:
+        idx = _index(name)
+        print(f"{name}: {len(_map(name))} surface forms, {sum(len(b) for b in idx.buckets.values())} fuzzy tokens")
@@ -1,12 +1,16 @@
-import glob, os, json
-from src.utils.io import read_jsonl, write_jsonl, ensure_dir
+import os, json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Tuple
+from src.utils.io import open_text, list_jsonl, open_jsonl_sink, JSONL_EXTS, save_json
 from src.utils.logger import get_logger
 from src.data_prep.cleaners.text_clean import normalize_text
 from src.data_prep.labeling import umls_map
 
 log = get_logger("merge")
 
-def unify_row(r):
+def unify_row(r, label=True):
     # Ensure schema v2 required keys exist
     r.setdefault("id", None)
     r.setdefault("modality", ["text"])
@@ -21,27 +25,95 @@ def unify_row(r):
     if r["text"]:
         r["text"] = normalize_text(r["text"])
     # Optional: auto-label map
-    if r["text"]:
+    if label and r["text"]:
         r["labels"].setdefault("icd10", umls_map.map_icd10(r["text"]))
         r["labels"].setdefault("snomed", umls_map.map_snomed(r["text"]))
     return r
 
-def merge_dirs(input_dirs, out_path):
-    ensure_dir(os.path.dirname(out_path))
-    count = 0
-    with open(out_path, "w", encoding="utf-8") as out_f:
-        for d in input_dirs:
-            for p in glob.glob(os.path.join(d, "*.jsonl")):
-                for r in read_jsonl(p):
-                    u = unify_row(r)
-                    out_f.write(json.dumps(u, ensure_ascii=False) + "\n")
-                    count += 1
-    log.info(f"Merged {count} rows → {out_path}")
+def unify_rows(rows: List[Dict]) -> List[Dict]:
+    """unify_row over a batch, labeling through the batched umls_map API."""
+    rows = [unify_row(r, label=False) for r in rows]
+    for key, fn in (("icd10", umls_map.map_icd10_batch), ("snomed", umls_map.map_snomed_batch)):
+        todo = [r for r in rows if r["text"] and key not in r["labels"]]
+        for r, codes in zip(todo, fn([r["text"] for r in todo], workers=1)):
+            r["labels"][key] = codes
+    return rows
+
+def _merge_batch(lines: List[str]) -> Tuple[List[str], Dict[str, List[int]]]:
+    """Worker: parse, unify + label, serialize. Returns output lines and {source: [rows, bytes]}."""
+    rows = unify_rows([json.loads(l) for l in lines if l.strip()])
+    out, stats = [], {}
+    for r in rows:
+        s = json.dumps(r, ensure_ascii=False) + "\n"
+        out.append(s)
+        st = stats.setdefault((r.get("meta") or {}).get("source", "unknown"), [0, 0])
+        st[0] += 1
+        st[1] += len(s.encode("utf-8"))
+    return out, stats
+
+def _line_batches(paths: List[str], batch: int):
+    for p in paths:
+        with open_text(p, "rt") as f:
+            while True:
+                lines = list(islice(f, batch))
+                if not lines:
+                    break
+                yield lines
+
+def merge_dirs(input_dirs, out_path, workers: int = 1, batch: int = 1000, shard_size: int = 50000):
+    """
+    Merge JSONL files / shard dirs (.jsonl, .gz, .zst) into `out_path`: a shard directory
+    (ShardWriter, manifest.json), or a single file if it ends in a JSONL extension; either
+    form replaces the previous output (shards are staged and swapped in on success).
+    The main process only reads lines; parsing, unification and labeling run in `workers`
+    processes, and results are written in input order, so output is deterministic.
+    A per-source rows/bytes summary is written to merge_summary.json.
+    """
+    paths = [p for d in input_dirs for p in list_jsonl(d)]
+    single = out_path.endswith(JSONL_EXTS)
+    sink = open_jsonl_sink(out_path, prefix="part", shard_size=shard_size, replace=True)
+    summary: Dict[str, Dict[str, int]] = {}
+
+    def consume(result):
+        lines, stats = result
+        sink.write_lines(lines)
+        for src, (n, b) in stats.items():
+            s = summary.setdefault(src, {"rows": 0, "bytes": 0})
+            s["rows"] += n
+            s["bytes"] += b
+
+    ex = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending: deque = deque()
+    batches = _line_batches(paths, batch)
+    try:
+        with sink:
+            if ex is None:
+                for lines in batches:
+                    consume(_merge_batch(lines))
+            else:
+                for lines in batches:
+                    pending.append(ex.submit(_merge_batch, lines))
+                    if len(pending) >= 2 * workers:
+                        consume(pending.popleft().result())
+                while pending:
+                    consume(pending.popleft().result())
+    finally:
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+    count = sum(s["rows"] for s in summary.values())
+    save_json(os.path.join((os.path.dirname(out_path) or ".") if single else out_path, "merge_summary.json"),
+              {"inputs": len(paths), "rows": count, "by_source": summary})
+    log.info(f"Merged {count} rows from {len(paths)} files → {out_path}")
+    for src, s in sorted(summary.items()):
+        log.info(f"  {src}: {s['rows']} rows, {s['bytes'] / 1e6:.1f} MB")
 
 if __name__ == "__main__":
     import argparse
     ap = argparse.ArgumentParser()
     ap.add_argument("--inputs", nargs="+", required=True)
-    ap.add_argument("--out", required=True)
+    ap.add_argument("--out", required=True, help="Output shard directory, or a .jsonl[.gz|.zst] file")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=1000, help="Rows per worker task")
+    ap.add_argument("--shard_size", type=int, default=50000)
     args = ap.parse_args()
-    merge_dirs(args.inputs, args.out)
+    merge_dirs(args.inputs, args.out, args.workers, args.batch, args.shard_size)
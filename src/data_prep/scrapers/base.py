@@ -1,12 +1,29 @@
 # src/data_prep/scrapers/base.py
 from __future__ import annotations
-import os, time, random, requests, json, re
-from typing import Dict, Any, Optional, Iterator
+import os, time, random, requests, json, re, threading, uuid, tempfile
+from typing import Dict, Any, Optional, Iterator, IO
+from urllib.parse import urljoin, urlsplit
+from requests.adapters import HTTPAdapter
 
-__all__ = ["Scraper", "req_json"]
+from src.utils.io import ShardWriter, save_json_atomic, load_json
+from .http_cache import ResponseCache, CacheMiss
+from src.utils.logger import get_logger
+
+try:
+    import fcntl  # POSIX only; cross-process limiter sharing
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+__all__ = ["Scraper", "HttpClient", "RateLimiter", "CheckpointStore", "ResponseCache", "CacheMiss",
+           "req_json", "req_file", "mk_id"]
 
 DEFAULT_USER_AGENT = f"Orph/1.0 ({os.getenv('SCRAPER_EMAIL','noreply@example.com')})"
 _CTL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')  # keep \t \n \r
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+log = get_logger("scraper")
+
+def mk_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:16]}"
 
 def _backoff_sleep(delay: float) -> float:
     time.sleep(delay + random.uniform(0, 0.3))
@@ -19,6 +36,220 @@ def _try_parse_json_text(text: str) -> Any:
         clean = _CTL_RE.sub('', text)
         return json.loads(clean, strict=False)
 
+class _Retry(Exception):
+    pass
+
+def _decode_json_response(r: requests.Response) -> Any:
+    """Parse a JSON response, raising _Retry for anything worth another attempt."""
+    ctype = (r.headers.get("Content-Type") or "").lower()
+    body = r.text
+
+    if r.status_code in _RETRY_STATUS:
+        raise _Retry() from RuntimeError(f"{r.status_code} from server: {body[:200]}")
+
+    if "text/html" in ctype or "xml" in ctype:
+        raise _Retry() from RuntimeError(f"Non-JSON response ({ctype}): {body[:200]}")
+
+    if "application/json" in ctype:
+        try:
+            return r.json()
+        except Exception:
+            if body.lstrip().startswith("<"):
+                raise _Retry() from RuntimeError(f"Claimed JSON but got HTML: {body[:200]}")
+            try:
+                return _try_parse_json_text(body)
+            except Exception as e:
+                raise _Retry() from e
+
+    try:
+        r.raise_for_status()
+    except Exception as e:
+        raise _Retry() from e
+
+    try:
+        return _try_parse_json_text(body)
+    except Exception as e:
+        raise _Retry() from e
+
+def _get_json(send, url: str, params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]], *,
+              tries: int, delay: float, cache: Optional[ResponseCache]) -> Any:
+    """
+    Retry loop shared by HttpClient.json and req_json. `send(url, params, headers)`
+    performs one paced GET. With a cache, stored validators turn the request into a
+    conditional GET and a 304 is answered from disk; replay mode never calls send().
+    """
+    key = meta = None
+    if cache is not None:
+        key = cache.key(url, params)
+        meta = cache.lookup(key)
+        if cache.replay:
+            if meta is None:
+                raise CacheMiss(f"not in cache (replay mode): {url} {params}")
+            return _try_parse_json_text(cache.load_text(key))
+        if meta is not None:
+            headers = {**(headers or {}), **cache.conditional_headers(meta)}
+
+    last_exc: Optional[Exception] = None
+    for _ in range(tries):
+        try:
+            r = send(url, params, headers)
+        except requests.RequestException as e:
+            last_exc = e
+            delay = _backoff_sleep(delay); continue
+        if r.status_code == 304 and meta is not None:
+            return _try_parse_json_text(cache.load_text(key))
+        try:
+            js = _decode_json_response(r)
+        except _Retry as e:
+            last_exc = e.__cause__ or e
+            delay = _backoff_sleep(delay); continue
+        if cache is not None:
+            cache.store(key, url, r.text, r.headers)
+        return js
+    raise last_exc or RuntimeError(f"Failed after {tries} attempts: {url}")
+
+class RateLimiter:
+    """
+    Token bucket: `calls_per_sec` refill, up to `burst` tokens banked.
+    sleep() only blocks when the bucket is empty, so callers under quota pay nothing.
+
+    Limiters are shared per key (usually the host) across threads via `for_host`.
+    With `state_dir` (or ORPH_RATELIMIT_DIR) the bucket lives in a flock'd file so
+    several processes hitting the same host share one budget.
+    """
+    _registry: Dict[str, "RateLimiter"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, calls_per_sec: float, burst: int = 1, key: Optional[str] = None,
+                 state_dir: Optional[str] = None):
+        self.rate = max(float(calls_per_sec), 1e-6)
+        self.burst = max(1, int(burst))
+        self.key = key
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+        state_dir = state_dir or os.getenv("ORPH_RATELIMIT_DIR")
+        self._state_path = None
+        if state_dir and key and fcntl is not None:
+            os.makedirs(state_dir, exist_ok=True)
+            safe = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+            self._state_path = os.path.join(state_dir, f"{safe}.bucket")
+
+    @classmethod
+    def for_host(cls, url_or_host: str, calls_per_sec: float, burst: int = 1,
+                 state_dir: Optional[str] = None) -> "RateLimiter":
+        """Process-wide limiter for a host; the first caller fixes the budget."""
+        host = urlsplit(url_or_host).netloc or url_or_host
+        with cls._registry_lock:
+            rl = cls._registry.get(host)
+            if rl is None:
+                rl = cls(calls_per_sec, burst, key=host, state_dir=state_dir)
+                cls._registry[host] = rl
+            return rl
+
+    def _take(self, tokens: float, stamp: float, now: float):
+        """Refill + take one token. Returns (tokens, stamp, wait_seconds)."""
+        tokens = min(float(self.burst), tokens + (now - stamp) * self.rate)
+        tokens -= 1.0
+        wait = 0.0 if tokens >= 0 else -tokens / self.rate
+        return tokens, now, wait
+
+    def _take_shared(self) -> float:
+        # Wall clock here: monotonic clocks are not comparable across processes.
+        with open(self._state_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    tokens, stamp = (float(x) for x in f.read().split())
+                except ValueError:
+                    tokens, stamp = float(self.burst), time.time()
+                tokens, stamp, wait = self._take(tokens, stamp, time.time())
+                f.seek(0); f.truncate()
+                f.write(f"{tokens} {stamp}")
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+    def sleep(self) -> None:
+        """Acquire one call slot, blocking only for the deficit."""
+        if self._state_path:
+            wait = self._take_shared()
+        else:
+            with self._lock:
+                self._tokens, self._stamp, wait = self._take(self._tokens, self._stamp, time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+
+    acquire = sleep
+
+class HttpClient:
+    """
+    Keep-alive requests.Session with a sized connection pool, gzip negotiation
+    and the same retry/backoff + tolerant JSON parsing as req_json.
+    Safe to share across threads (requests' pool is thread-safe for GETs).
+    JSON responses go through `cache` (default: ResponseCache.from_env()).
+    """
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        *,
+        timeout: int = 45,
+        headers: Optional[Dict[str, str]] = None,
+        tries: int = 8,
+        backoff: float = 0.34,
+        pool_size: int = 16,
+        rate_limiter: Optional[RateLimiter] = None,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.base_url = base_url.rstrip("/") + "/" if base_url else None
+        self.timeout = timeout
+        self.tries = tries
+        self.backoff = backoff
+        self.rl = rate_limiter
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "User-Agent": DEFAULT_USER_AGENT,
+        })
+        if headers: self.session.headers.update(headers)
+
+    def _url(self, url: str) -> str:
+        if self.base_url and not urlsplit(url).scheme:
+            return urljoin(self.base_url, url.lstrip("/"))
+        return url
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, str]] = None, **kw) -> requests.Response:
+        if self.rl: self.rl.sleep()
+        return self.session.get(self._url(url), params=params, headers=headers,
+                                timeout=kw.pop("timeout", self.timeout), **kw)
+
+    def json(self, url: str, params: Optional[Dict[str, Any]] = None,
+             headers: Optional[Dict[str, str]] = None) -> Any:
+        """Robust JSON GET with retry/backoff, tolerant parsing and conditional caching."""
+        return _get_json(lambda u, p, h: self.get(u, params=p, headers=h), self._url(url), params, headers,
+                         tries=self.tries, delay=self.backoff, cache=self.cache)
+
+    def close(self) -> None:
+        self.session.close()
+
+_default_client: Optional[HttpClient] = None
+_default_lock = threading.Lock()
+
+def _shared_client() -> HttpClient:
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
 def req_json(
     url: str,
     params: Dict[str, Any],
@@ -28,64 +259,221 @@ def req_json(
     timeout: int = 45,
     headers: Optional[Dict[str, str]] = None,
 ) -> Dict[str, Any]:
-    """Robust JSON GET with retry/backoff and tolerant parsing."""
-    hdrs = {"Accept": "application/json", "User-Agent": DEFAULT_USER_AGENT}
-    if headers: hdrs.update(headers)
-
-    delay = min_sleep
-    last_exc: Optional[Exception] = None
-    for _ in range(tries):
-        r = requests.get(url, params=params, headers=hdrs, timeout=timeout)
-        ctype = (r.headers.get("Content-Type") or "").lower()
-        body = r.text
+    """
+    Robust JSON GET with retry/backoff and tolerant parsing.
+    Runs on a pooled keep-alive session; `min_sleep` is the per-host call interval,
+    enforced by a shared token bucket rather than an unconditional sleep.
+    Honors the ORPH_HTTP_CACHE response cache (see http_cache.ResponseCache).
+    """
+    client = _shared_client()
+    rl = RateLimiter.for_host(url, calls_per_sec=1.0 / max(min_sleep, 1e-3), burst=1)
 
-        if r.status_code in (429, 500, 502, 503, 504):
-            last_exc = RuntimeError(f"{r.status_code} from server: {body[:200]}")
-            delay = _backoff_sleep(delay); continue
+    def send(u, p, h):
+        rl.sleep()
+        return client.session.get(u, params=p, headers=h, timeout=timeout)
 
-        if "text/html" in ctype or "xml" in ctype:
-            last_exc = RuntimeError(f"Non-JSON response ({ctype}): {body[:200]}")
-            delay = _backoff_sleep(delay); continue
+    return _get_json(send, url, params, headers, tries=tries, delay=min_sleep, cache=client.cache)
 
-        if "application/json" in ctype:
-            try:
-                js = r.json()
-            except Exception:
-                if body.lstrip().startswith("<"):
-                    last_exc = RuntimeError(f"Claimed JSON but got HTML: {body[:200]}")
-                    delay = _backoff_sleep(delay); continue
-                try:
-                    js = _try_parse_json_text(body)
-                except Exception as e:
-                    last_exc = e
-                    delay = _backoff_sleep(delay); continue
-            time.sleep(min_sleep)
-            return js  # type: ignore[return-value]
+def req_file(
+    url: str,
+    params: Dict[str, Any],
+    *,
+    min_sleep: float = 0.34,
+    tries: int = 8,
+    timeout: int = 120,
+    headers: Optional[Dict[str, str]] = None,
+    chunk_size: int = 1 << 16,
+) -> IO[bytes]:
+    """
+    Streamed GET into an anonymous temp file, rewound and ready to parse.
+    Same pacing/retry as req_json; the body never sits in memory, and a
+    dropped connection retries the whole download instead of half-parsing it.
+    Goes through the ORPH_HTTP_CACHE response cache like req_json: a 304 or a
+    replay-mode hit returns the stored body, a fresh download is stored for next time.
+    """
+    client = _shared_client()
+    cache = client.cache
+    rl = RateLimiter.for_host(url, calls_per_sec=1.0 / max(min_sleep, 1e-3), burst=1)
 
-        try:
-            r.raise_for_status()
-        except Exception as e:
-            last_exc = e
-            delay = _backoff_sleep(delay); continue
+    key = meta = None
+    if cache is not None:
+        key = cache.key(url, params)
+        meta = cache.lookup(key)
+        if cache.replay:
+            if meta is None:
+                raise CacheMiss(f"not in cache (replay mode): {url} {params}")
+            return cache.open_body(key)
+        if meta is not None:
+            headers = {**(headers or {}), **cache.conditional_headers(meta)}
 
+    delay = min_sleep
+    last_exc: Optional[Exception] = None
+    for _ in range(tries):
+        rl.sleep()
+        f = tempfile.TemporaryFile()
         try:
-            js = _try_parse_json_text(body)
-            time.sleep(min_sleep)
-            return js
-        except Exception as e:
+            with client.session.get(url, params=params, headers=headers, timeout=timeout, stream=True) as r:
+                if r.status_code == 304 and meta is not None:
+                    f.close()
+                    return cache.open_body(key)
+                if r.status_code in _RETRY_STATUS:
+                    raise RuntimeError(f"{r.status_code} from server: {r.text[:200]}")
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                resp_headers = r.headers
+            if cache is not None:
+                f.seek(0)
+                cache.store_file(key, url, f, resp_headers)
+            f.seek(0)
+            return f
+        except (requests.RequestException, RuntimeError) as e:
+            f.close()
             last_exc = e
             delay = _backoff_sleep(delay)
 
     raise last_exc or RuntimeError(f"Failed after {tries} attempts: {url}")
 
+class CheckpointStore:
+    """
+    JSON cursor file for resumable scrapes, replaced atomically on every save.
+    Holds whatever the scraper needs to continue (cursor, WebEnv/query_key, ...)
+    plus bookkeeping: rows written, last committed shard and a `query` fingerprint
+    so a checkpoint from a different query is never resumed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Any]:
+        return load_json(self.path, {}) or {}
+
+    def save(self, state: Dict[str, Any]) -> None:
+        save_json_atomic(self.path, {**state, "updated": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 class Scraper:
-    def __init__(self, out_dir: str):
+    """
+    Base scraper: subclasses implement stream(); run() drains it into rotating
+    JSONL shards under out_dir (see ShardWriter) and stops after max_docs rows.
+
+    Resumable scrapers (`resumable = True`) call self.checkpoint(state) after each
+    page and start from self.resume_state(). Shards then rotate only at page
+    boundaries and the checkpoint is persisted whenever a shard is committed, so
+    checkpoint.json always matches the committed shards; a crash loses at most the
+    open shard, which is discarded and re-fetched on the next run.
+
+    A run that starts from scratch (no checkpoint, a finished one, or resume=False)
+    writes a new shard set that replaces the old one when the run completes (see
+    ShardWriter replace mode); until then readers keep seeing the previous crawl.
+    Scrapers whose fresh runs only add to the existing rows (incremental syncs)
+    override incremental().
+    """
+    name = "scraper"
+    resumable = False
+    CHECKPOINT = "checkpoint.json"
+
+    def __init__(
+        self,
+        out_dir: str,
+        *,
+        client: Optional[HttpClient] = None,
+        shard_size: int = 5000,
+        max_docs: Optional[int] = None,
+        compression: Optional[str] = "auto",
+        resume: bool = True,
+    ):
         self.out_dir = out_dir
         os.makedirs(out_dir, exist_ok=True)
+        self.client = client
+        self.shard_size = shard_size
+        self.max_docs = max_docs
+        self.compression = compression
+        self.resume = resume
+        self.ckpt = CheckpointStore(os.path.join(out_dir, self.CHECKPOINT))
+        self._writer: Optional[ShardWriter] = None
+        self._pending: Optional[Dict[str, Any]] = None
+        self._rows_base = 0
 
     def stream(self) -> Iterator[Dict[str, Any]]:
         raise NotImplementedError
 
-    def run(self) -> None:
-        for _ in self.stream():
-            pass
+    def query_key(self) -> Any:
+        """JSON-able fingerprint of the crawl parameters; a checkpoint is only resumed if it matches."""
+        return None
+
+    def incremental(self) -> bool:
+        """True if this run adds to the published shards instead of replacing them."""
+        return False
+
+    def _open_checkpoint(self) -> Dict[str, Any]:
+        """The unfinished checkpoint for this query, if resuming."""
+        if not (self.resume and self.resumable):
+            return {}
+        st = self.ckpt.load()
+        if not st or st.get("done") or st.get("query") != self.query_key():
+            return {}
+        return st
+
+    def resume_state(self) -> Dict[str, Any]:
+        """Saved cursor state for this query, or {} to start from scratch."""
+        st = self._open_checkpoint()
+        if not st:
+            return {}
+        self._rows_base = int(st.get("rows", 0))
+        log.info(f"[{self.name}] resuming from checkpoint: cursor={st.get('cursor')!r} rows={st.get('rows')}")
+        return st
+
+    def checkpoint(self, state: Dict[str, Any]) -> None:
+        """Mark a page boundary: every row yielded so far belongs to `state`."""
+        self._pending = state
+        if self._writer is not None and self._writer.full:
+            self._writer.commit_shard()
+            self._save_checkpoint()
+
+    def _save_checkpoint(self, done: bool = False) -> None:
+        if self._pending is None:
+            return
+        w = self._writer
+        self.ckpt.save({
+            **self._pending,
+            "query": self.query_key(),
+            "rows": self._rows_base + (w.rows_total if w else 0),
+            "last_shard": w.last_shard if w else None,
+            "done": done,
+        })
+
+    def open_writer(self) -> ShardWriter:
+        resuming = bool(self._open_checkpoint())
+        staged = os.path.exists(os.path.join(self.out_dir, ShardWriter.STAGING, ShardWriter.MANIFEST))
+        # a checkpoint without a staging dir belongs to a crawl written in place: finish it in place
+        replace = not self.incremental() and (staged or not resuming)
+        return ShardWriter(self.out_dir, prefix="part", shard_size=self.shard_size,
+                           compression=self.compression, auto_rotate=not self.resumable,
+                           replace=replace, resume_staging=resuming)
+
+    def run(self) -> int:
+        n = 0
+        w = self._writer = self.open_writer()
+        try:
+            for row in self.stream():
+                w.write(row)
+                n += 1
+                if self.max_docs and n >= self.max_docs:
+                    break
+        except BaseException:
+            if self.resumable:
+                w.abort_shard()  # keep shards consistent with the last saved checkpoint
+            elif w.replace:
+                w.abort()  # the previous crawl stays published
+            else:
+                w.close()
+            raise
+        w.close()
+        if self.resumable:
+            self._save_checkpoint(done=True)
+        self._writer = None
+        log.info(f"[{self.name}] wrote {n} rows → {self.out_dir} ({w.shard_idx} shards total)")
+        return n
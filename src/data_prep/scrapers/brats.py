@@ -2,7 +2,8 @@ import os, glob, argparse
 import numpy as np
 import nibabel as nib
 from PIL import Image
-from typing import Iterator, Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Dict, List, Optional
 from .base import Scraper, mk_id
 from src.utils.io import ensure_dir
 from src.utils.logger import get_logger
@@ -12,75 +13,123 @@ log = get_logger("brats")
 Looks for subject folders containing *_flair.nii.gz / *_t1ce.nii.gz / *_t1.nii.gz / *_t2.nii.gz
 Emits a center axial slice PNG for each available modality and a multimodal composite.
 Labels are not attached here (varies by release); set answer=None, keep meta.
+
+Only the requested axial slices are read through nibabel's lazy ArrayProxy (never the
+full float64 volume), composites reuse the in-memory slices, and subjects can be spread
+over a process pool.
 """
 
-def _load_center_slice(nii_path: str) -> np.ndarray:
-    img = nib.load(nii_path)
-    data = img.get_fdata()
-    z = data.shape[2] // 2
-    sl = data[:, :, z]
+MODALITIES = ["flair", "t1ce", "t1", "t2"]
+
+def _slice_indices(depth: int, n_slices: int, spacing: int) -> List[int]:
+    """Center slice, or n_slices centered axial slices `spacing` apart."""
+    z = depth // 2
+    if n_slices <= 1:
+        return [z]
+    half = (n_slices - 1) // 2
+    idx = [z + (i - half) * spacing for i in range(n_slices)]
+    return [min(max(i, 0), depth - 1) for i in idx]
+
+def _normalize(sl: np.ndarray) -> np.ndarray:
     # normalize robustly
     p1, p99 = np.percentile(sl, [1, 99])
     sl = np.clip((sl - p1) / (p99 - p1 + 1e-6), 0, 1)
     return (sl * 255).astype(np.uint8)
 
+def _load_slices(nii_path: str, zs: Optional[List[int]] = None) -> List[np.ndarray]:
+    img = nib.load(nii_path)
+    proxy = img.dataobj  # lazy: slicing reads only those planes
+    zs = zs if zs is not None else [img.shape[2] // 2]
+    return [_normalize(np.asarray(proxy[:, :, z], dtype=np.float32)) for z in zs]
+
+def _load_center_slice(nii_path: str) -> np.ndarray:
+    return _load_slices(nii_path)[0]
+
 def _save_png(arr: np.ndarray, out_path: str):
     Image.fromarray(arr).save(out_path)
 
+def _find_modalities(sub: str) -> Dict[str, str]:
+    modal = {}
+    for key in MODALITIES:
+        cand = glob.glob(os.path.join(sub, f"*_{key}.nii*"))
+        if cand:
+            modal[key] = cand[0]
+    return modal
+
+def process_subject(sub: str, out_img_dir: str, n_slices: int = 1, spacing: int = 4) -> Optional[Dict]:
+    """All PNGs for one subject; returns the schema v2 row (None if no modalities)."""
+    modal = _find_modalities(sub)
+    if not modal:
+        return None
+    base = os.path.basename(sub)
+    depth = nib.load(next(iter(modal.values()))).shape[2]
+    zs = _slice_indices(depth, n_slices, spacing)
+
+    # Generate per-modality slice PNGs (n_slices > 1 → vertical axial stack per modality)
+    pngs, arrs = {}, []
+    for k, p in modal.items():
+        sls = _load_slices(p, zs)
+        w = min(a.shape[1] for a in sls)
+        arr = np.concatenate([a[:, :w] for a in sls], axis=0) if len(sls) > 1 else sls[0]
+        op = os.path.join(out_img_dir, f"{base}_{k}.png")
+        _save_png(arr, op)
+        pngs[k] = op
+        arrs.append(arr)
+
+    # Optional composite (stacked horizontally if >=2), from the arrays already in memory
+    if len(arrs) >= 2:
+        h = min(a.shape[0] for a in arrs)
+        comp = np.concatenate([a[:h, :] for a in arrs], axis=1)
+        target_img = os.path.join(out_img_dir, f"{base}_composite.png")
+        _save_png(comp, target_img)
+    else:
+        target_img = list(pngs.values())[0]
+
+    meta = {"source": "brats", "license": "research-only", "subject": base, "modalities": list(pngs.keys())}
+    if n_slices > 1:
+        meta["slices"] = zs
+    return {
+        "id": mk_id("brats"),
+        "modality": ["image"],
+        "task": "classification",
+        "text": None,
+        "image_path": target_img.replace("\\", "/"),
+        "answer": None,
+        "rationale": None,
+        "labels": {},
+        "meta": meta,
+        "split": "train"
+    }
+
 class BraTSScraper(Scraper):
     name = "brats"
 
-    def __init__(self, out_dir: str, cases_root: str, out_img_dir: str):
+    def __init__(self, out_dir: str, cases_root: str, out_img_dir: str,
+                 workers: int = 1, n_slices: int = 1, spacing: int = 4):
         super().__init__(out_dir)
         self.cases_root = cases_root
         self.out_img_dir = out_img_dir
+        self.workers = max(1, workers)
+        self.n_slices = max(1, n_slices)
+        self.spacing = max(1, spacing)
         ensure_dir(self.out_img_dir)
 
     def stream(self) -> Iterator[Dict]:
-        subs = [d for d in glob.glob(os.path.join(self.cases_root, "*")) if os.path.isdir(d)]
+        subs = sorted(d for d in glob.glob(os.path.join(self.cases_root, "*")) if os.path.isdir(d))
         count = 0
-        for sub in subs:
-            modal = {}
-            for key in ["flair","t1ce","t1","t2"]:
-                cand = glob.glob(os.path.join(sub, f"*_{key}.nii*"))
-                if cand:
-                    modal[key] = cand[0]
-            if not modal:
-                continue
-
-            # Generate per-modality slice PNGs
-            pngs = {}
-            for k, p in modal.items():
-                arr = _load_center_slice(p)
-                op = os.path.join(self.out_img_dir, f"{os.path.basename(sub)}_{k}.png")
-                _save_png(arr, op)
-                pngs[k] = op
-
-            # Optional composite (stacked horizontally if >=2)
-            if len(pngs) >= 2:
-                arrs = [np.array(Image.open(v)) for v in pngs.values()]
-                h = min(a.shape[0] for a in arrs)
-                arrs = [a[:h, :] for a in arrs]
-                comp = np.concatenate(arrs, axis=1)
-                comp_path = os.path.join(self.out_img_dir, f"{os.path.basename(sub)}_composite.png")
-                _save_png(comp, comp_path)
-                target_img = comp_path
-            else:
-                target_img = list(pngs.values())[0]
-
-            yield {
-                "id": mk_id("brats"),
-                "modality": ["image"],
-                "task": "classification",
-                "text": None,
-                "image_path": target_img.replace("\\","/"),
-                "answer": None,
-                "rationale": None,
-                "labels": {},
-                "meta": {"source":"brats","license":"research-only","modalities": list(pngs.keys())},
-                "split":"train"
-            }
-            count += 1
+        args = ([self.out_img_dir] * len(subs), [self.n_slices] * len(subs), [self.spacing] * len(subs))
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as ex:
+                # chunks amortize IPC; ordered like the sorted subject list
+                for row in ex.map(process_subject, subs, *args, chunksize=4):
+                    if row is not None:
+                        count += 1
+                        yield row
+        else:
+            for row in map(process_subject, subs, *args):
+                if row is not None:
+                    count += 1
+                    yield row
         log.info(f"[BraTS] emitted {count} rows")
 
 if __name__ == "__main__":
@@ -88,5 +137,8 @@ if __name__ == "__main__":
     ap.add_argument("--out", required=True)
     ap.add_argument("--cases_root", required=True)
     ap.add_argument("--out_img_dir", default="data/images/brats_png")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--n_slices", type=int, default=1, help=">1 writes a centered axial stack per modality")
+    ap.add_argument("--spacing", type=int, default=4, help="Slice spacing for --n_slices")
     args = ap.parse_args()
-    BraTSScraper(args.out, args.cases_root, args.out_img_dir).run()
+    BraTSScraper(args.out, args.cases_root, args.out_img_dir, args.workers, args.n_slices, args.spacing).run()
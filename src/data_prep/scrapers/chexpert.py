@@ -1,37 +1,67 @@
-import csv, argparse, os
+import argparse, os
+import pandas as pd
 from typing import Iterator, Dict
 from .base import Scraper, mk_id
+from src.utils.io import scan_files, write_frame
+from src.utils.logger import get_logger
+log = get_logger("chexpert")
+
+# CheXpert label columns: 1.0 positive, 0.0 negative, -1.0 uncertain, blank = not mentioned
+PATHOLOGIES = [
+    "No Finding", "Enlarged Cardiomediastinum", "Cardiomegaly", "Lung Opacity", "Lung Lesion",
+    "Edema", "Consolidation", "Pneumonia", "Atelectasis", "Pneumothorax", "Pleural Effusion",
+    "Pleural Other", "Fracture", "Support Devices",
+]
 
 class CheXpertScraper(Scraper):
     name = "chexpert"
-    def __init__(self, out_dir: str, images_root: str, train_csv: str):
+    def __init__(self, out_dir: str, images_root: str, train_csv: str, verify_files: bool = False):
         super().__init__(out_dir); self.images_root=images_root; self.train_csv=train_csv
+        self.verify_files = verify_files
+
+    def frame(self) -> pd.DataFrame:
+        """Schema v2 rows as a DataFrame; every pathology column becomes labels["chexpert"]."""
+        df = pd.read_csv(self.train_csv)
+        if self.verify_files:
+            # one recursive listing instead of a stat per row
+            files = scan_files(self.images_root, (".jpg", ".png"), recursive=True)
+            df = df[df["Path"].isin(files)].reset_index(drop=True)
+        cols = [c for c in PATHOLOGIES if c in df.columns]
+        lab = df[cols].astype(object).where(df[cols].notna(), None)
+        root = os.path.join(self.images_root, "").replace("\\", "/")
+        patient = df["Path"].astype(str).str.extract(r"(patient\d+)", expand=False)
+        # Example: turn Cardiomegaly=1 into label
+        cardio = df["Cardiomegaly"].eq(1.0) if "Cardiomegaly" in df else pd.Series(False, index=df.index)
+        return pd.DataFrame({
+            "id": [mk_id("chexpert") for _ in range(len(df))],
+            "modality": [["image"] for _ in range(len(df))],
+            "task": "classification",
+            "text": None,
+            "image_path": (root + df["Path"].astype(str)).str.replace("\\", "/", regex=False),
+            "answer": cardio.map({True: "Cardiomegaly", False: "No cardiomegaly"}),
+            "rationale": None,
+            "labels": [{"chexpert": d} for d in lab.to_dict("records")],
+            "meta": [{"source": "chexpert", "license": "custom", "patient_id": p} for p in patient.astype(object).where(patient.notna(), None)],
+            "split": "train",
+        })
 
     def stream(self) -> Iterator[Dict]:
-        with open(self.train_csv, "r", encoding="utf-8") as f:
-            rdr = csv.DictReader(f)
-            for row in rdr:
-                img_rel = row["Path"]
-                image_path = os.path.join(self.images_root, img_rel)
-                # Example: turn Cardiomegaly=1 into label
-                label = "Cardiomegaly" if row.get("Cardiomegaly","") == "1.0" else "No cardiomegaly"
-                yield {
-                    "id": mk_id("chexpert"),
-                    "modality": ["image"],
-                    "task": "classification",
-                    "text": None,
-                    "image_path": image_path.replace("\\","/"),
-                    "answer": label,
-                    "rationale": None,
-                    "labels": {},
-                    "meta": {"source":"chexpert","license":"custom"},
-                    "split":"train"
-                }
+        yield from self.frame().to_dict("records")
+
+    def run(self) -> int:
+        df = self.frame()
+        if self.max_docs:
+            df = df.head(self.max_docs)
+        with self.open_writer() as w:
+            n = write_frame(w, df)
+        log.info(f"[chexpert] emitted {n} rows → {self.out_dir}")
+        return n
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--out", required=True)
     ap.add_argument("--images_root", required=True)
     ap.add_argument("--train_csv", required=True)
+    ap.add_argument("--verify_files", action="store_true", help="Drop rows whose image is missing (one dir walk)")
     args = ap.parse_args()
-    CheXpertScraper(args.out, args.images_root, args.train_csv).run()
+    CheXpertScraper(args.out, args.images_root, args.train_csv, args.verify_files).run()
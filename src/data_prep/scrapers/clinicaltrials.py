@@ -1,33 +1,69 @@
 # src/data_prep/scrapers/clinicaltrials.py
 from __future__ import annotations
-import argparse
+import os, argparse
 from typing import Iterator, Dict, Optional
 
-from .base import Scraper, HttpClient, RateLimiter, mk_id
+from .base import Scraper, HttpClient, RateLimiter, CheckpointStore
+from src.utils.io import compact_shards
 from src.utils.logger import get_logger
 log = get_logger("clinicaltrials")
 
 API = "https://clinicaltrials.gov/api/v2"
+# Only what _to_rows reads (+ last update for the sync high-water mark)
+FIELDS = ",".join([
+    "NCTId", "BriefTitle", "Condition", "OverallStatus", "BriefSummary", "LastUpdatePostDate",
+])
 
 class ClinicalTrialsScraper(Scraper):
     name = "clinicaltrials"
+    resumable = True
 
-    def __init__(self, out_dir: str, expr: str, page_size: int, shard_size: int, max_docs: Optional[int]):
-        client = HttpClient(base_url=API, timeout=60)
-        super().__init__(out_dir, client=client, shard_size=shard_size, max_docs=max_docs)
-        self.expr = expr
+    def __init__(self, out_dir: str, expr: str, page_size: int, shard_size: int, max_docs: Optional[int],
+                 resume: bool = True, since: Optional[str] = None):
         # API is OK with ~ 5–10 qps; stay conservative
-        self.rl = RateLimiter(calls_per_sec=4.0, burst=2)
-        self.page_size = min(max(1, page_size), 100)
+        rl = RateLimiter.for_host(API, calls_per_sec=4.0, burst=2)
+        client = HttpClient(base_url=API, timeout=60, rate_limiter=rl)
+        super().__init__(out_dir, client=client, shard_size=shard_size, max_docs=max_docs, resume=resume)
+        self.expr = expr
+        # projected pages are small, so the API maximum is fine
+        self.page_size = min(max(1, page_size), 1000)
+        # "last" → high-water mark from the previous sync; else YYYY-MM-DD or None (full crawl)
+        self.sync = CheckpointStore(os.path.join(out_dir, "sync.json"))
+        if since == "last":
+            prev = self.sync.load()
+            since = prev.get("high_water") if prev.get("query") == {"expr": expr} else None
+        self.since = since
+        self._high_water = since
+        self._complete = False
 
     def _page(self, token: str | None) -> Dict:
-        self.rl.sleep()
-        params = {"format": "json", "query.term": self.expr, "pageSize": self.page_size}
+        params = {"format": "json", "query.term": self.expr, "pageSize": self.page_size, "fields": FIELDS}
+        if self.since:
+            # inclusive: studies updated on the high-water day itself are re-fetched and upserted
+            params["filter.advanced"] = f"AREA[LastUpdatePostDate]RANGE[{self.since},MAX]"
         if token: params["pageToken"] = token
         return self.client.json("studies", params=params)
 
+    def query_key(self) -> Dict:
+        return {"expr": self.expr, "since": self.since}
+
+    def incremental(self) -> bool:
+        # an update sync upserts into the existing shards (compacted below); a full crawl replaces them
+        return bool(self.since)
+
+    def run(self) -> int:
+        n = super().run()
+        # upsert: a study re-fetched by this sync replaces its older row
+        dropped = compact_shards(self.out_dir, key=lambda r: r.get("id"))
+        if self._complete:
+            # a partial crawl (max_docs) must not advance the mark past unfetched studies
+            self.sync.save({"query": {"expr": self.expr}, "high_water": self._high_water})
+        log.info(f"[clinicaltrials] sync since={self.since or 'beginning'}: {n} rows, {dropped} superseded, "
+                 f"high_water={self._high_water}")
+        return n
+
     def stream(self) -> Iterator[Dict]:
-        token = None
+        token = self.resume_state().get("cursor")
         seen = 0
         while True:
             js = self._page(token)
@@ -39,26 +75,32 @@ class ClinicalTrialsScraper(Scraper):
                 seen += 1
             token = js.get("nextPageToken")
             if not token:
+                self._complete = True
                 break
+            self.checkpoint({"cursor": token})
 
     def _to_rows(self, st: Dict) -> Iterator[Dict]:
         prot = st.get("protocolSection", {})
         ident = prot.get("identificationModule", {})
         conds = prot.get("conditionsModule", {}).get("conditions", [])
-        status = prot.get("statusModule", {}).get("overallStatus", "")
+        status_mod = prot.get("statusModule", {})
+        status = status_mod.get("overallStatus", "")
+        updated = status_mod.get("lastUpdatePostDateStruct", {}).get("date")
+        if updated and (self._high_water is None or updated > self._high_water):
+            self._high_water = updated
         desc = prot.get("descriptionModule", {}).get("briefSummary", "")
         nct = ident.get("nctId","")
         title = ident.get("briefTitle","")
         text = f"{title} ({nct}). Conditions={', '.join(conds)}. Status={status}. Summary: {desc}"
         yield {
-            "id": mk_id("ct"),
+            "id": f"ct_{nct}",
             "modality": ["text"],
             "task": "summarize",
             "text": text,
             "answer": None,
             "rationale": None,
             "labels": {},
-            "meta": {"source": "clinicaltrials", "license": "public-domain", "nct": nct},
+            "meta": {"source": "clinicaltrials", "license": "public-domain", "nct": nct, "last_update": updated},
             "split": "train"
         }
 
@@ -69,5 +111,9 @@ if __name__ == "__main__":
     ap.add_argument("--page_size", type=int, default=100)
     ap.add_argument("--shard_size", type=int, default=5000)
     ap.add_argument("--max_docs", type=int, default=None)
+    ap.add_argument("--fresh", action="store_true", help="Ignore checkpoint.json and start over")
+    ap.add_argument("--since", default=None,
+                    help="Only studies updated on/after YYYY-MM-DD, or 'last' for the previous sync's high-water mark")
     args = ap.parse_args()
-    ClinicalTrialsScraper(args.out, args.expr, args.page_size, args.shard_size, args.max_docs).run()
+    ClinicalTrialsScraper(args.out, args.expr, args.page_size, args.shard_size, args.max_docs,
+                          resume=not args.fresh, since=args.since).run()
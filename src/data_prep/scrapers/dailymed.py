@@ -1,6 +1,7 @@
 # src/data_prep/scrapers/dailymed.py
 from __future__ import annotations
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterator, Dict, Optional
 
 from .base import Scraper, HttpClient, RateLimiter, mk_id
@@ -12,45 +13,62 @@ SPL_API   = "https://dailymed.nlm.nih.gov/dailymed/services/v2/spls/{setid}.json
 
 class DailyMedScraper(Scraper):
     name = "dailymed"
+    resumable = True
 
-    def __init__(self, out_dir: str, page_size: int, shard_size: int, max_docs: Optional[int]):
-        client = HttpClient(timeout=60)
-        super().__init__(out_dir, client=client, shard_size=shard_size, max_docs=max_docs)
+    def __init__(self, out_dir: str, page_size: int, shard_size: int, max_docs: Optional[int], workers: int = 8,
+                 resume: bool = True):
+        self.workers = max(1, workers)
+        rl = RateLimiter.for_host(INDEX_API, calls_per_sec=3.0, burst=2)
+        client = HttpClient(timeout=60, pool_size=self.workers + 1, rate_limiter=rl)
+        super().__init__(out_dir, client=client, shard_size=shard_size, max_docs=max_docs, resume=resume)
         self.ps = max(1, min(100, page_size))
-        self.rl = RateLimiter(calls_per_sec=3.0, burst=2)
 
     def _list_page(self, page_idx: int) -> Dict:
-        self.rl.sleep()
         return self.client.json(INDEX_API, params={"pagesize": self.ps, "page": page_idx})
 
     def _get_spl(self, setid: str) -> Dict:
-        self.rl.sleep()
         return self.client.json(SPL_API.format(setid=setid))
 
+    def query_key(self) -> Dict:
+        return {"pagesize": self.ps}
+
     def stream(self) -> Iterator[Dict]:
-        page = 1
-        seen = 0
-        while True:
-            js = self._list_page(page)
-            items = js.get("data", [])
-            if not items:
-                break
-            for it in items:
+        """
+        Keeps up to `workers` SPL fetches in flight (all still paced by the shared
+        RateLimiter) and prefetches the next index page while details download.
+        Rows are yielded in index order within each page.
+        """
+        ex = ThreadPoolExecutor(max_workers=self.workers + 1, thread_name_prefix="dailymed")
+        try:
+            page = self.resume_state().get("cursor", 1)
+            seen = 0
+            next_page = ex.submit(self._list_page, page)
+            while True:
+                js = next_page.result()
+                items = js.get("data", [])
+                if not items:
+                    break
+                # index page goes in first so it overlaps with this page's detail fetches
+                next_page = ex.submit(self._list_page, page + 1)
+                setids = [it.get("setid") for it in items if it.get("setid")]
+                if self.max_docs:
+                    setids = setids[: max(0, self.max_docs - seen)]
+                futs = [(setid, ex.submit(self._get_spl, setid)) for setid in setids]
+                for setid, fut in futs:
+                    try:
+                        yield self._to_row(fut.result(), setid)
+                        seen += 1
+                    except Exception as e:
+                        log.warning(f"[dailymed] setid={setid} failed: {e}")
+                        continue
                 if self.max_docs and seen >= self.max_docs:
                     return
-                setid = it.get("setid")
-                if not setid:
-                    continue
-                try:
-                    spl = self._get_spl(setid)
-                    yield self._to_row(spl)
-                    seen += 1
-                except Exception as e:
-                    log.warning(f"[dailymed] setid={setid} failed: {e}")
-                    continue
-            page += 1
+                page += 1
+                self.checkpoint({"cursor": page})
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
 
-    def _to_row(self, spl: Dict) -> Dict:
+    def _to_row(self, spl: Dict, setid: Optional[str] = None) -> Dict:
         data = spl.get("data", {})
         title = data.get("title", "")
         sections = {sec.get("code",""): sec.get("text","") for sec in data.get("sections", [])}
@@ -65,7 +83,8 @@ class DailyMedScraper(Scraper):
             "answer": None,
             "rationale": None,
             "labels": {},
-            "meta": {"source":"dailymed","license":"public-domain"},
+            # SPL set id: same key as openFDA's, so a label's rows share a split across both sources
+            "meta": {"source":"dailymed","license":"public-domain","spl_set_id": setid or data.get("setid")},
             "split":"train"
         }
 
@@ -75,5 +94,7 @@ if __name__ == "__main__":
     ap.add_argument("--page_size", type=int, default=100)
     ap.add_argument("--shard_size", type=int, default=5000)
     ap.add_argument("--max_docs", type=int, default=None)
+    ap.add_argument("--workers", type=int, default=8, help="SPL detail requests kept in flight")
+    ap.add_argument("--fresh", action="store_true", help="Ignore checkpoint.json and start over")
     args = ap.parse_args()
-    DailyMedScraper(args.out, args.page_size, args.shard_size, args.max_docs).run()
+    DailyMedScraper(args.out, args.page_size, args.shard_size, args.max_docs, args.workers, resume=not args.fresh).run()
@@ -0,0 +1,152 @@
+# src/data_prep/scrapers/http_cache.py
+from __future__ import annotations
+import os, json, hashlib, shutil, threading, time
+from typing import IO, Callable, Dict, Any, Optional
+
+__all__ = ["ResponseCache", "CacheMiss"]
+
+# params that identify the caller, not the resource
+_IGNORED_PARAMS = {"api_key", "email", "tool"}
+
+class CacheMiss(RuntimeError):
+    """Replay-only mode and the response was never cached."""
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of GET responses, keyed by URL + params: JSON bodies
+    (store/load_text) and streamed downloads such as EFetch XML (store_file/open_body).
+
+    mode="on":     send If-None-Match / If-Modified-Since from the stored validators;
+                   a 304 is served from disk with no body transferred.
+    mode="replay": never touch the network; a miss raises CacheMiss.
+
+    Entries are `<root>/<k[:2]>/<k>.body` (raw response body) plus `<k>.meta.json`
+    (url, ETag, Last-Modified, size). Entry mtime is bumped on every hit, and once the
+    total exceeds max_bytes the least recently used entries are evicted down to 90%.
+    """
+    def __init__(self, root: str, mode: str = "on", max_bytes: int = 2 << 30):
+        if mode not in ("on", "replay"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.root, self.mode, self.max_bytes = root, mode, int(max_bytes)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total = sum(e["size"] for e in self._entries())
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """ORPH_HTTP_CACHE=<dir> enables it; ORPH_HTTP_CACHE_MODE=on|replay, ORPH_HTTP_CACHE_MAX_MB."""
+        root = os.getenv("ORPH_HTTP_CACHE")
+        if not root:
+            return None
+        return cls(root, mode=os.getenv("ORPH_HTTP_CACHE_MODE", "on"),
+                   max_bytes=int(float(os.getenv("ORPH_HTTP_CACHE_MAX_MB", "2048")) * (1 << 20)))
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        items = sorted((k, str(v)) for k, v in (params or {}).items() if k not in _IGNORED_PARAMS)
+        return hashlib.sha256(json.dumps([url, items]).encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str):
+        d = os.path.join(self.root, key[:2])
+        return os.path.join(d, f"{key}.meta.json"), os.path.join(d, f"{key}.body")
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        meta_p, _ = self._paths(key)
+        try:
+            with open(meta_p, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_text(self, key: str) -> str:
+        meta_p, body_p = self._paths(key)
+        with open(body_p, "r", encoding="utf-8") as f:
+            text = f.read()
+        now = time.time()
+        try:
+            os.utime(meta_p, (now, now))  # LRU recency
+        except OSError:
+            pass
+        return text
+
+    def open_body(self, key: str) -> IO[bytes]:
+        """The stored body as a binary file; caller closes it."""
+        meta_p, body_p = self._paths(key)
+        f = open(body_p, "rb")
+        now = time.time()
+        try:
+            os.utime(meta_p, (now, now))  # LRU recency
+        except OSError:
+            pass
+        return f
+
+    @staticmethod
+    def conditional_headers(meta: Dict[str, Any]) -> Dict[str, str]:
+        h = {}
+        if meta.get("etag"): h["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"): h["If-Modified-Since"] = meta["last_modified"]
+        return h
+
+    def store(self, key: str, url: str, text: str, headers) -> None:
+        self._store(key, url, headers, lambda f: f.write(text.encode("utf-8")))
+
+    def store_file(self, key: str, url: str, src: IO[bytes], headers) -> None:
+        """Copy `src` from its current position to the end (the caller rewinds it afterwards)."""
+        self._store(key, url, headers, lambda f: shutil.copyfileobj(src, f))
+
+    def _store(self, key: str, url: str, headers, write: Callable[[IO[bytes]], Any]) -> None:
+        meta_p, body_p = self._paths(key)
+        os.makedirs(os.path.dirname(meta_p), exist_ok=True)
+        old = self.lookup(key)
+        # body first, meta last: a meta file always points at a complete body
+        tmp = f"{body_p}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, body_p)
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "stored": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "size": size,
+        }
+        tmp = f"{meta_p}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_p)
+        with self._lock:
+            self._total += size - (old["size"] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d):
+                continue
+            for fn in os.listdir(d):
+                if not fn.endswith(".meta.json"):
+                    continue
+                p = os.path.join(d, fn)
+                try:
+                    st = os.stat(p)
+                    with open(p, "r", encoding="utf-8") as f:
+                        size = json.load(f).get("size", 0)
+                except (OSError, ValueError):
+                    continue
+                yield {"key": fn[: -len(".meta.json")], "size": size, "atime": st.st_mtime}
+
+    def _evict(self) -> None:
+        target = int(self.max_bytes * 0.9)
+        for e in sorted(self._entries(), key=lambda e: e["atime"]):
+            if self._total <= target:
+                break
+            for p in self._paths(e["key"]):
+                try: os.remove(p)
+                except OSError: pass
+            self._total -= e["size"]
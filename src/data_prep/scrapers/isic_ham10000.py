@@ -1,6 +1,7 @@
 import os, argparse, pandas as pd
 from typing import Iterator, Dict
 from .base import Scraper, mk_id
+from src.utils.io import scan_files, write_frame
 from src.utils.logger import get_logger
 log = get_logger("ham10000")
 
@@ -10,8 +11,13 @@ Expected files:
   - images under: data/images/isic/ (or your chosen root)
   - metadata CSV: HAM10000_metadata.csv with columns:
       image_id, dx (diagnosis), dx_type, age, sex, localization
+The manifest is built with column operations: one directory listing joined against the
+metadata frame (no per-row stat), then serialized to shards in bulk.
 """
 
+def _nullable(s: pd.Series) -> list:
+    return s.astype(object).where(s.notna(), None).tolist()
+
 class HAM10000Scraper(Scraper):
     name = "isic_ham10000"
 
@@ -20,36 +26,49 @@ class HAM10000Scraper(Scraper):
         self.images_root = images_root
         self.meta_csv = meta_csv
 
-    def stream(self) -> Iterator[Dict]:
+    def frame(self) -> pd.DataFrame:
+        """Schema v2 rows as a DataFrame, one column per key."""
         df = pd.read_csv(self.meta_csv)
-        total = 0
-        for _, r in df.iterrows():
-            img_file = f"{r['image_id']}.jpg"
-            image_path = os.path.join(self.images_root, img_file)
-            if not os.path.exists(image_path): 
-                continue
-            dx = str(r.get("dx","unknown"))
-            meta = {
-                "source": "isic_ham10000",
-                "license": "CC-BY",
-                "age": int(r["age"]) if not pd.isna(r["age"]) else None,
-                "sex": r.get("sex", None),
-                "site": r.get("localization", None)
-            }
-            yield {
-                "id": mk_id("isic"),
-                "modality": ["image"],
-                "task": "classification",
-                "text": None,
-                "image_path": image_path.replace("\\","/"),
-                "answer": dx,
-                "rationale": None,
-                "labels": {"icd10": [], "snomed": []},
-                "meta": meta,
-                "split": "train"
-            }
-            total += 1
-        log.info(f"[HAM10000] emitted {total} rows.")
+        files = scan_files(self.images_root, (".jpg",))
+        df = df[(df["image_id"].astype(str) + ".jpg").isin(files)].reset_index(drop=True)
+        root = os.path.join(self.images_root, "").replace("\\", "/")
+        ages = df["age"].round().astype("Int64") if "age" in df else pd.Series(pd.NA, index=df.index, dtype="Int64")
+        none = [None] * len(df)
+        meta = [
+            {"source": "isic_ham10000", "license": "CC-BY", "image_id": img, "lesion_id": les,
+             "age": a, "sex": sx, "site": site}
+            for img, les, a, sx, site in zip(df["image_id"].astype(str),
+                                             _nullable(df["lesion_id"]) if "lesion_id" in df else none,
+                                             _nullable(ages),
+                                             _nullable(df["sex"]) if "sex" in df else none,
+                                             _nullable(df["localization"]) if "localization" in df else none)
+        ]
+        out = pd.DataFrame({
+            "id": [mk_id("isic") for _ in range(len(df))],
+            "modality": [["image"] for _ in range(len(df))],
+            "task": "classification",
+            "text": None,
+            "image_path": root + df["image_id"].astype(str) + ".jpg",
+            "answer": df["dx"].fillna("unknown").astype(str) if "dx" in df else "unknown",
+            "rationale": None,
+            "labels": [{"icd10": [], "snomed": []} for _ in range(len(df))],
+            "meta": meta,
+            "split": "train",
+        })
+        log.info(f"[HAM10000] {len(out)} of {len(files)} images matched metadata.")
+        return out
+
+    def stream(self) -> Iterator[Dict]:
+        yield from self.frame().to_dict("records")
+
+    def run(self) -> int:
+        df = self.frame()
+        if self.max_docs:
+            df = df.head(self.max_docs)
+        with self.open_writer() as w:
+            n = write_frame(w, df)
+        log.info(f"[HAM10000] emitted {n} rows.")
+        return n
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
@@ -1,33 +1,117 @@
 # src/data_prep/scrapers/openfda_labels.py
 from __future__ import annotations
-import os, argparse
-from typing import Iterator, Dict, Optional
+import os, io, glob, zipfile, argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Dict, Optional, List
 
 from .base import Scraper, HttpClient, RateLimiter, mk_id
+from src.utils.io import ShardWriter, iter_json_items, load_json, save_json_atomic
 from src.utils.logger import get_logger
 log = get_logger("openfda")
 
 API = "https://api.fda.gov/drug/label.json"
 API_KEY = os.getenv("OPENFDA_API_KEY")
 
+def iter_bulk_labels(zip_path: str) -> Iterator[Dict]:
+    """Label docs from one openFDA bulk part (drug-label-000N-of-000M.json.zip), decompressed and parsed as a stream."""
+    with zipfile.ZipFile(zip_path) as zf:
+        for name in zf.namelist():
+            if not name.endswith(".json"):
+                continue
+            with zf.open(name) as raw:
+                yield from iter_json_items(io.TextIOWrapper(raw, encoding="utf-8"), key="results")
+
+def _part_prefix(zip_path: str) -> str:
+    return os.path.basename(zip_path).split(".")[0]
+
+BULK_SUBDIR = "bulk"
+
+def _zip_fingerprint(zip_path: str) -> str:
+    st = os.stat(zip_path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def _remove_part(out_dir: str, prefix: str) -> None:
+    for p in glob.glob(os.path.join(out_dir, f"{prefix}-*")) + glob.glob(os.path.join(out_dir, f"{prefix}.manifest.json")):
+        os.remove(p)
+
+def ingest_bulk_part(zip_path: str, out_dir: str, shard_size: int = 5000, compression: Optional[str] = "auto",
+                     resume: bool = True) -> int:
+    """
+    Convert one bulk part into `<part>-NNNNN.jsonl.*` shards with its own `<part>.manifest.json`,
+    so parts can run in separate processes. A part already ingested from the same zip (size +
+    mtime) is skipped unless resume=False; a new export under the same name, or a part
+    interrupted mid-way, is redone from scratch.
+    """
+    prefix = _part_prefix(zip_path)
+    manifest = f"{prefix}.manifest.json"
+    fingerprint = _zip_fingerprint(zip_path)
+    prev = load_json(os.path.join(out_dir, manifest), {})
+    if resume and prev.get("complete") and prev.get("zip") == fingerprint:
+        return 0
+    _remove_part(out_dir, prefix)
+    n = 0
+    with ShardWriter(out_dir, prefix=prefix, shard_size=shard_size, compression=compression, manifest=manifest) as w:
+        for doc in iter_bulk_labels(zip_path):
+            w.write(OpenFDALabelsScraper._to_row(doc))
+            n += 1
+    w.manifest.update({"complete": True, "zip": fingerprint})
+    save_json_atomic(w.manifest_path, w.manifest)
+    log.info(f"[openfda] {os.path.basename(zip_path)}: {n} labels")
+    return n
+
 class OpenFDALabelsScraper(Scraper):
     name = "openfda_labels"
+    resumable = True
 
-    def __init__(self, out_dir: str, limit_per_page: int, shard_size: int, max_docs: Optional[int]):
+    def __init__(self, out_dir: str, limit_per_page: int, shard_size: int, max_docs: Optional[int],
+                 resume: bool = True, bulk_files: Optional[List[str]] = None, workers: int = 1):
         headers = {}
         if API_KEY: headers["X-Api-Key"] = API_KEY
-        client = HttpClient(timeout=60, headers=headers)
-        super().__init__(out_dir, client=client, shard_size=shard_size, max_docs=max_docs)
-        self.limit = max(1, min(100, limit_per_page))
         # OpenFDA rate guidance ~ 240 req/min with key; be safe:
-        self.rl = RateLimiter(calls_per_sec=4.0 if API_KEY else 2.0, burst=2)
+        rl = RateLimiter.for_host(API, calls_per_sec=4.0 if API_KEY else 2.0, burst=2)
+        client = HttpClient(timeout=60, headers=headers, rate_limiter=rl)
+        super().__init__(out_dir, client=client, shard_size=shard_size, max_docs=max_docs, resume=resume)
+        self.limit = max(1, min(100, limit_per_page))
+        # local bulk export instead of limit/skip paging (no skip ceiling, no network)
+        self.bulk_files = sorted(bulk_files or [])
+        self.workers = max(1, workers)
+
+    def query_key(self) -> Dict:
+        return {"limit": self.limit}
+
+    def run(self) -> int:
+        if not self.bulk_files:
+            return super().run()
+        # one process per zip part; each writes its own shards + manifest (resumable per part), in a
+        # subdir of their own so they never mix with API-mode part-* shards
+        out_dir = os.path.join(self.out_dir, BULK_SUBDIR)
+        os.makedirs(out_dir, exist_ok=True)
+        current = {_part_prefix(z) for z in self.bulk_files}
+        for m in glob.glob(os.path.join(out_dir, "*.manifest.json")):
+            prefix = os.path.basename(m)[: -len(".manifest.json")]
+            if prefix not in current:  # part no longer in the export
+                _remove_part(out_dir, prefix)
+        k = len(self.bulk_files)
+        args = ([out_dir] * k, [self.shard_size] * k, [self.compression] * k, [self.resume] * k)
+        if self.workers == 1:
+            counts = list(map(ingest_bulk_part, self.bulk_files, *args))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as ex:
+                counts = list(ex.map(ingest_bulk_part, self.bulk_files, *args))
+        n = sum(counts)
+        log.info(f"[{self.name}] wrote {n} rows from {len(self.bulk_files)} bulk parts → {out_dir}")
+        return n
 
     def stream(self) -> Iterator[Dict]:
-        skip, seen = 0, 0
+        if self.bulk_files:
+            for zp in self.bulk_files:
+                for doc in iter_bulk_labels(zp):
+                    yield self._to_row(doc)
+            return
+        skip, seen = self.resume_state().get("cursor", 0), 0
         while True:
             if self.max_docs and seen >= self.max_docs:
                 return
-            self.rl.sleep()
             params = {"limit": self.limit, "skip": skip}
             if API_KEY: params["api_key"] = API_KEY
             js = self.client.json(API, params=params)
@@ -40,8 +124,10 @@ class OpenFDALabelsScraper(Scraper):
                 yield self._to_row(d)
                 seen += 1
             skip += self.limit
+            self.checkpoint({"cursor": skip})
 
-    def _to_row(self, doc: Dict) -> Dict:
+    @staticmethod
+    def _to_row(doc: Dict) -> Dict:
         of = doc.get("openfda", {})
         product = (of.get("brand_name") or of.get("generic_name") or ["unknown"])[0]
         bw = " ".join(doc.get("boxed_warning", [])[:1])
@@ -56,7 +142,7 @@ class OpenFDALabelsScraper(Scraper):
             "answer": None,
             "rationale": None,
             "labels": {},
-            "meta": {"source":"openfda","license":"public-domain","spl_set_id": doc.get("spl_set_id","")},
+            "meta": {"source":"openfda","license":"public-domain","spl_set_id": doc.get("set_id") or (of.get("spl_set_id") or [""])[0]},
             "split":"train"
         }
 
@@ -66,5 +152,13 @@ if __name__ == "__main__":
     ap.add_argument("--limit_per_page", type=int, default=100)
     ap.add_argument("--shard_size", type=int, default=5000)
     ap.add_argument("--max_docs", type=int, default=None)
+    ap.add_argument("--fresh", action="store_true", help="Ignore checkpoint.json and start over")
+    ap.add_argument("--bulk_dir", default=None,
+                    help="Read drug-label-*.json.zip bulk exports from this dir instead of the API "
+                         "(shards go to <out>/bulk)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Processes for --bulk_dir (one zip part each; --max_docs does not apply)")
     args = ap.parse_args()
-    OpenFDALabelsScraper(args.out, args.limit_per_page, args.shard_size, args.max_docs).run()
+    bulk = sorted(glob.glob(os.path.join(args.bulk_dir, "*.json.zip"))) if args.bulk_dir else None
+    OpenFDALabelsScraper(args.out, args.limit_per_page, args.shard_size, args.max_docs, resume=not args.fresh,
+                         bulk_files=bulk, workers=args.workers).run()
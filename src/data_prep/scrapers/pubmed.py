@@ -1,22 +1,36 @@
 # src/data_prep/scrapers/pubmed.py
 from __future__ import annotations
-import os, sys, time, json
-from typing import Iterator, Dict, Any, Optional
+import os, sys, re
+import datetime as dt
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Dict, Any, Optional, IO, List
 
 # Import guard (works with -m and direct path)
 try:
-    from .base import Scraper, req_json
+    from .base import Scraper, req_json, req_file, mk_id
 except ImportError:
     ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
     if ROOT not in sys.path: sys.path.insert(0, ROOT)
-    from src.data_prep.scrapers.base import Scraper, req_json
+    from src.data_prep.scrapers.base import Scraper, req_json, req_file, mk_id
+from src.utils.io import read_jsonl, load_json, ShardWriter
 
 EUTILS = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
 API_KEY = os.getenv("NCBI_API_KEY")
 CONTACT = os.getenv("SCRAPER_EMAIL", "noreply@example.com")
 _DEF_HEADERS = {"User-Agent": f"Orph/1.0 ({CONTACT})"}
+# E-utilities allow 3 req/s without a key, 10 req/s with one (shared per host)
+_MIN_SLEEP = 0.1 if API_KEY else 0.34
+_WS_RE = re.compile(r"\s+")
+# E-utilities only page through the first 10k records of one search
+WINDOW_CAP = 9999
 
-def esearch(term: str, mindate: Optional[str] = None, maxdate: Optional[str] = None):
+class HistoryExpired(RuntimeError):
+    """The WebEnv/query_key no longer resolves on the History server."""
+
+def esearch(term: str, mindate: Optional[str] = None, maxdate: Optional[str] = None,
+            datetype: Optional[str] = None):
     """Get count + History server (WebEnv/query_key)."""
     params = {
         "db": "pubmed",
@@ -31,7 +45,8 @@ def esearch(term: str, mindate: Optional[str] = None, maxdate: Optional[str] = N
     if API_KEY: params["api_key"] = API_KEY
     if mindate: params["mindate"] = mindate
     if maxdate: params["maxdate"] = maxdate
-    js = req_json(f"{EUTILS}/esearch.fcgi", params, headers=_DEF_HEADERS)
+    if datetype: params["datetype"] = datetype
+    js = req_json(f"{EUTILS}/esearch.fcgi", params, min_sleep=_MIN_SLEEP, headers=_DEF_HEADERS)
     es = js["esearchresult"]
     return int(es["count"]), es.get("webenv"), es.get("querykey")
 
@@ -49,37 +64,322 @@ def esummary_history(webenv: str, qk: str, retstart: int, retmax: int) -> Dict[s
         "email": CONTACT,
     }
     if API_KEY: params["api_key"] = API_KEY
-    return req_json(f"{EUTILS}/esummary.fcgi", params, headers=_DEF_HEADERS)
+    return req_json(f"{EUTILS}/esummary.fcgi", params, min_sleep=_MIN_SLEEP, headers=_DEF_HEADERS)
+
+def efetch_history(webenv: str, qk: str, retstart: int, retmax: int) -> IO[bytes]:
+    """EFetch PubMed XML (abstracts) via History into a temp file; caller closes it."""
+    params = {
+        "db": "pubmed",
+        "retmode": "xml",
+        "retstart": retstart,
+        "retmax": retmax,      # EFetch allows up to 10k per call
+        "WebEnv": webenv,
+        "query_key": qk,
+        "tool": "Orph",
+        "email": CONTACT,
+    }
+    if API_KEY: params["api_key"] = API_KEY
+    return req_file(f"{EUTILS}/efetch.fcgi", params, min_sleep=_MIN_SLEEP, headers=_DEF_HEADERS, timeout=300)
+
+def _text(el: Optional[ET.Element]) -> str:
+    if el is None:
+        return ""
+    return _WS_RE.sub(" ", "".join(el.itertext())).strip()
+
+def _article_row(el: ET.Element) -> Dict[str, Any]:
+    mc = el.find("MedlineCitation")
+    art = mc.find("Article")
+    pmid = mc.findtext("PMID")
+    title = _text(art.find("ArticleTitle"))
+    parts = []
+    for ab in art.findall("Abstract/AbstractText"):
+        t = _text(ab)
+        if t:
+            label = ab.get("Label")
+            parts.append(f"{label}: {t}" if label else t)
+    abstract = " ".join(parts)
+    pd = art.find("Journal/JournalIssue/PubDate")
+    pubdate = (pd.findtext("Year") or pd.findtext("MedlineDate")) if pd is not None else None
+    authors = []
+    for a in art.findall("AuthorList/Author"):
+        name = " ".join(x for x in (a.findtext("LastName"), a.findtext("Initials")) if x) or a.findtext("CollectiveName")
+        if name: authors.append(name)
+    doi = el.find("PubmedData/ArticleIdList/ArticleId[@IdType='doi']")
+    return {
+        "id": mk_id("pubmed"),
+        "modality": ["text"],
+        "task": "summarize",
+        "text": f"{title}\n{abstract}".strip(),
+        "answer": None,
+        "rationale": None,
+        "labels": {},
+        "meta": {
+            "source": "pubmed",
+            "license": "NLM-terms",
+            "pmid": pmid,
+            "title": title,
+            "journal": art.findtext("Journal/Title"),
+            "pubdate": pubdate,
+            "authors": authors,
+            "pub_types": [_text(x) for x in art.findall("PublicationTypeList/PublicationType")],
+            "doi": doi.text if doi is not None else None,
+            "has_abstract": bool(abstract),
+        },
+        "split": "train",
+    }
+
+def parse_pubmed_xml(f: IO[bytes]) -> Iterator[Dict[str, Any]]:
+    """
+    Incremental PubmedArticleSet parser: each article is converted and then dropped
+    from the tree, so memory is one article regardless of batch size.
+    """
+    ctx = ET.iterparse(f, events=("start", "end"))
+    _, root = next(ctx)
+    if root.tag != "PubmedArticleSet":
+        # expired/invalid History sessions come back as <eFetchResult><ERROR>...
+        raise HistoryExpired(f"unexpected EFetch root <{root.tag}>")
+    for ev, el in ctx:
+        if ev != "end":
+            continue
+        if el.tag == "PubmedArticle":
+            yield _article_row(el)
+            root.clear()
+        elif el.tag == "PubmedBookArticle":
+            root.clear()
+
+def _esummary_rows(res: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for uid in res.get("uids", []):
+        rec = res.get(uid)
+        if not rec:
+            continue
+        yield {
+            "pmid": uid,
+            "title": rec.get("title"),
+            "pubdate": rec.get("pubdate"),
+            "authors": [a.get("name") for a in rec.get("authors", [])],
+            "journal": rec.get("fulljournalname"),
+            "source": "pubmed_esummary",
+        }
+
+def _parse_date(s: Optional[str], end: bool = False) -> dt.date:
+    """'YYYY', 'YYYY/MM' or 'YYYY/MM/DD' → first (or last, if end) day it covers."""
+    if not s:
+        return dt.date.today() if end else dt.date(1800, 1, 1)
+    parts = [int(x) for x in re.split(r"[/-]", s)]
+    y, m, d = (parts + [None, None])[:3]
+    if m is None:
+        return dt.date(y, 12, 31) if end else dt.date(y, 1, 1)
+    if d is None:
+        if not end:
+            return dt.date(y, m, 1)
+        nxt = dt.date(y + m // 12, m % 12 + 1, 1)
+        return nxt - dt.timedelta(days=1)
+    return dt.date(y, m, d)
+
+def _fmt(d: dt.date) -> str:
+    return d.strftime("%Y/%m/%d")
+
+def plan_date_windows(term: str, mindate: Optional[str], maxdate: Optional[str],
+                      cap: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Bisect [mindate, maxdate] by publication date until every window matches <= cap
+    records. Bounds are inclusive, so halves are [lo, mid] and [mid+1, hi].
+    A single day above the cap cannot be split further and is kept (truncated at cap).
+    """
+    cap = cap or WINDOW_CAP
+    out: List[Dict[str, Any]] = []
+    stack = [(_parse_date(mindate), _parse_date(maxdate, end=True))]
+    while stack:
+        lo, hi = stack.pop()
+        count, _, _ = esearch(term, _fmt(lo), _fmt(hi), datetype="pdat")
+        if count == 0:
+            continue
+        if count > cap and lo < hi:
+            mid = lo + (hi - lo) // 2
+            stack.append((mid + dt.timedelta(days=1), hi))
+            stack.append((lo, mid))
+            continue
+        if count > cap:
+            print(f"[pubmed] {_fmt(lo)} has {count} records (> {cap}); only the first {cap} are reachable")
+        out.append({"mindate": _fmt(lo), "maxdate": _fmt(hi), "count": count})
+    return out
 
 class PubMedScraper(Scraper):
-    def __init__(self, out_dir: str, term: str, mindate: Optional[str], maxdate: Optional[str], pagesize: int = 200):
-        super().__init__(out_dir)
+    name = "pubmed"
+    resumable = True
+
+    def __init__(self, out_dir: str, term: str, mindate: Optional[str], maxdate: Optional[str],
+                 pagesize: Optional[int] = None, shard_size: int = 5000, max_docs: Optional[int] = None,
+                 resume: bool = True, mode: str = "esummary", workers: int = 3, slice_dates: bool = True):
+        super().__init__(out_dir, shard_size=shard_size, max_docs=max_docs, resume=resume)
         self.term, self.mindate, self.maxdate = term, mindate, maxdate
-        # Keep pages modest to reduce malformed payload risk
-        self.pagesize = max(50, min(pagesize, 500))
+        if mode not in ("esummary", "efetch"):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.slice_dates = slice_dates
+        if mode == "efetch":
+            # XML is parsed incrementally, so large batches cost no extra memory
+            self.pagesize = max(50, min(pagesize or 2000, 10000))
+        else:
+            # Keep pages modest to reduce malformed payload risk
+            self.pagesize = max(50, min(pagesize or 200, 500))
+
+    def query_key(self) -> Dict[str, Any]:
+        return {"term": self.term, "mindate": self.mindate, "maxdate": self.maxdate, "mode": self.mode}
 
     def stream(self) -> Iterator[Dict[str, Any]]:
-        count, webenv, qk = esearch(self.term, self.mindate, self.maxdate)
+        st = self.resume_state()
+        if st.get("windows"):
+            yield from self._stream_windows(st["windows"], st["cursor"])
+            return
+        if st.get("webenv"):
+            count, webenv, qk, got = st["count"], st["webenv"], st["query_key"], st["cursor"]
+        else:
+            count, webenv, qk = esearch(self.term, self.mindate, self.maxdate)
+            got = 0
         print(f"[pubmed] found {count} ids for term='{self.term}'")
-        got = 0
+        if got == 0 and count > WINDOW_CAP and self.slice_dates:
+            windows = plan_date_windows(self.term, self.mindate, self.maxdate)
+            print(f"[pubmed] {count} > {WINDOW_CAP}: split into {len(windows)} date windows")
+            yield from self._stream_windows(windows, 0)
+            return
+        if self.mode == "efetch":
+            yield from self._stream_efetch(count, webenv, qk, got)
+            return
+        refreshed = False
         while got < count:
             batch = esummary_history(webenv, qk, retstart=got, retmax=min(self.pagesize, count - got))
-            res = batch.get("result", {})
+            res = batch.get("result")
+            if res is None and not refreshed:
+                # History server sessions expire; a resumed WebEnv may be gone
+                print(f"[pubmed] WebEnv expired at retstart={got}; re-running esearch")
+                count, webenv, qk = esearch(self.term, self.mindate, self.maxdate)
+                refreshed = True
+                continue
+            res = res or {}
             uids = res.get("uids", [])
-            for uid in uids:
-                rec = res.get(uid)
-                if not rec:
-                    continue
-                yield {
-                    "pmid": uid,
-                    "title": rec.get("title"),
-                    "pubdate": rec.get("pubdate"),
-                    "authors": [a.get("name") for a in rec.get("authors", [])],
-                    "journal": rec.get("fulljournalname"),
-                    "source": "pubmed_esummary",
-                }
+            if not uids:
+                break
+            refreshed = False
+            yield from _esummary_rows(res)
             got += len(uids)
-            time.sleep(0.34)  # polite pacing
+            self.checkpoint({"cursor": got, "count": count, "webenv": webenv, "query_key": qk})
+
+    def _fetch_window(self, win: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """All rows of one date window (<= WINDOW_CAP records), on its own History session."""
+        for attempt in range(2):
+            count, webenv, qk = esearch(self.term, win["mindate"], win["maxdate"], datetype="pdat")
+            count = min(count, WINDOW_CAP)
+            rows: List[Dict[str, Any]] = []
+            got = 0
+            try:
+                while got < count:
+                    n = min(self.pagesize, count - got)
+                    if self.mode == "efetch":
+                        with efetch_history(webenv, qk, got, n) as f:
+                            rows.extend(parse_pubmed_xml(f))
+                    else:
+                        res = esummary_history(webenv, qk, retstart=got, retmax=n).get("result")
+                        if res is None:
+                            raise HistoryExpired(f"esummary lost WebEnv for {win['mindate']}–{win['maxdate']}")
+                        rows.extend(_esummary_rows(res))
+                    got += n
+            except HistoryExpired:
+                if attempt: raise
+                continue
+            return rows
+        return []
+
+    def _seen_pmids(self) -> set:
+        """PMIDs already in committed shards (resume of a sliced crawl)."""
+        seen = set()
+        out_dir = self._writer.out_dir if self._writer else self.out_dir  # staging dir of a fresh crawl
+        manifest = load_json(os.path.join(out_dir, ShardWriter.MANIFEST), {"shards": []})
+        for ent in manifest["shards"]:
+            for r in read_jsonl(os.path.join(out_dir, ent["file"])):
+                pmid = r.get("pmid") or (r.get("meta") or {}).get("pmid")
+                if pmid: seen.add(int(pmid))
+        return seen
+
+    def _stream_windows(self, windows: List[Dict[str, Any]], start: int) -> Iterator[Dict[str, Any]]:
+        """
+        Fetch date windows `workers` at a time (requests still share the E-utilities
+        limiter), yield them in plan order and drop PMIDs already emitted by another
+        window. The checkpoint is the index of the next window, so resume is per window.
+        """
+        seen = self._seen_pmids() if start else set()
+        ex = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pubmed-win")
+        pending: deque = deque()
+        nxt = start
+
+        def fill():
+            nonlocal nxt
+            while len(pending) < self.workers and nxt < len(windows):
+                pending.append((nxt, ex.submit(self._fetch_window, windows[nxt])))
+                nxt += 1
+
+        try:
+            fill()
+            while pending:
+                i, fut = pending.popleft()
+                rows = fut.result()
+                fill()
+                dup = 0
+                for row in rows:
+                    pmid = int(row.get("pmid") or row["meta"]["pmid"])
+                    if pmid in seen:
+                        dup += 1
+                        continue
+                    seen.add(pmid)
+                    yield row
+                w = windows[i]
+                print(f"[pubmed] window {i + 1}/{len(windows)} {w['mindate']}–{w['maxdate']}: "
+                      f"{len(rows) - dup} rows ({dup} dup)")
+                self.checkpoint({"cursor": i + 1, "windows": windows})
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+    def _stream_efetch(self, count: int, webenv: str, qk: str, got: int) -> Iterator[Dict[str, Any]]:
+        """
+        Keeps `workers` EFetch windows downloading ahead (paced by the shared E-utilities
+        limiter) while the current window is parsed; windows are yielded in retstart order.
+        """
+        ex = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="efetch")
+        pending: deque = deque()
+        nxt = got
+
+        def fill():
+            nonlocal nxt
+            while len(pending) < self.workers and nxt < count:
+                n = min(self.pagesize, count - nxt)
+                pending.append((nxt, n, ex.submit(efetch_history, webenv, qk, nxt, n)))
+                nxt += n
+
+        try:
+            fill()
+            refreshed = False
+            while pending:
+                start, n, fut = pending.popleft()
+                try:
+                    with fut.result() as f:
+                        for row in parse_pubmed_xml(f):
+                            yield row
+                except HistoryExpired:
+                    if refreshed:
+                        raise
+                    print(f"[pubmed] WebEnv expired at retstart={start}; re-running esearch")
+                    for *_, p in pending: p.cancel()
+                    pending.clear()
+                    count, webenv, qk = esearch(self.term, self.mindate, self.maxdate)
+                    refreshed, nxt = True, start
+                    fill()
+                    continue
+                refreshed = False
+                self.checkpoint({"cursor": start + n, "count": count, "webenv": webenv, "query_key": qk})
+                fill()
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
     import argparse
@@ -90,19 +390,29 @@ if __name__ == "__main__":
     parser.add_argument("--mindate", default=None)
     parser.add_argument("--maxdate", default=None)
 
+    parser.add_argument("--mode", choices=["esummary", "efetch"], default="esummary",
+                        help="esummary: citation metadata; efetch: schema-v2 rows with abstract text")
+    parser.add_argument("--workers", type=int, default=3,
+                        help="EFetch batches / date windows fetched in parallel")
+    parser.add_argument("--no_slice", action="store_true",
+                        help=f"Do not split result sets above {WINDOW_CAP} into date windows")
+
     # Primary flag
-    parser.add_argument("--pagesize", type=int, default=200, help="Records per page (50–500)")
+    parser.add_argument("--pagesize", type=int, default=None,
+                        help="Records per page (esummary 50–500, default 200; efetch 50–10000, default 2000)")
     # Back-compat aliases
     parser.add_argument("--chunk", type=int, dest="pagesize", help="Alias for --pagesize")
     parser.add_argument("--efetch_chunk", type=int, dest="pagesize", help="Alias for --pagesize")
 
-    # Parse but IGNORE unknown old flags like --shard_size, --max_docs
+    parser.add_argument("--shard_size", type=int, default=5000)
+    parser.add_argument("--max_docs", type=int, default=None)
+    parser.add_argument("--fresh", action="store_true", help="Ignore checkpoint.json and start over")
+
+    # Parse but IGNORE unknown old flags
     args, unknown = parser.parse_known_args()
     if unknown:
         print(f"[pubmed] ignoring unknown args from older runner: {unknown}")
 
-    os.makedirs(args.out, exist_ok=True)
-    out_path = os.path.join(args.out, "pubmed_esummary.jsonl")
-    with open(out_path, "a", encoding="utf-8") as f:
-        for row in PubMedScraper(args.out, args.term, args.mindate, args.maxdate, args.pagesize).stream():
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    PubMedScraper(args.out, args.term, args.mindate, args.maxdate, args.pagesize,
+                  shard_size=args.shard_size, max_docs=args.max_docs, resume=not args.fresh,
+                  mode=args.mode, workers=args.workers, slice_dates=not args.no_slice).run()
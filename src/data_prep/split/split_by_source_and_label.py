@@ -1,26 +1,97 @@
-import random, json
-from src.utils.io import read_jsonl, write_jsonl
+import hashlib, os
+from typing import Dict, Any, Sequence, Tuple
+from src.utils.io import read_jsonl, list_jsonl, open_jsonl_sink, save_json
 from src.utils.logger import get_logger
 log = get_logger("split")
 
-def split(in_path, out_train, out_val, out_test, ratios=(0.8,0.1,0.1), seed=1337):
-    rng = random.Random(seed)
-    train, val, test = [], [], []
-    for r in read_jsonl(in_path):
-        x = rng.random()
-        if x < ratios[0]: train.append(r)
-        elif x < ratios[0]+ratios[1]: val.append(r)
-        else: test.append(r)
-    write_jsonl(out_train, train)
-    write_jsonl(out_val, val)
-    write_jsonl(out_test, test)
-    log.info(f"Split: train={len(train)} val={len(val)} test={len(test)}")
+SPLITS = ("train", "val", "test")
+# meta fields identifying rows that must share a split, most specific first. Field-prefixed
+# keys mean e.g. a PubMed abstract and its PMC full text (same pmid) land together.
+GROUP_KEYS = ("pmid", "pmcid", "nct", "spl_set_id", "patient_id", "lesion_id", "subject", "image_id", "isic_id")
+
+def group_key(r: Dict[str, Any], keys: Sequence[str] = GROUP_KEYS) -> str:
+    meta = r.get("meta") or {}
+    for k in keys:
+        v = meta.get(k)
+        if v not in (None, ""):
+            return f"{k}:{v}"
+    if r.get("id"):
+        return f"id:{r['id']}"
+    return "text:" + hashlib.blake2b((r.get("text") or "").encode("utf-8"), digest_size=16).hexdigest()
+
+def assign(key: str, ratios=(0.8, 0.1, 0.1), seed=1337) -> str:
+    """Stable split for a group key: a seeded 64-bit hash mapped onto the cumulative ratios."""
+    h = hashlib.blake2b(f"{seed}:{key}".encode("utf-8"), digest_size=8).digest()
+    x = int.from_bytes(h, "big") / 2**64
+    if x < ratios[0]: return "train"
+    if x < ratios[0] + ratios[1]: return "val"
+    return "test"
+
+def stratum(r: Dict[str, Any], fields: Sequence[str]) -> str:
+    """'source' -> meta.source, 'labels.<k>' -> first code, anything else -> the row field."""
+    parts = []
+    for f in fields:
+        if f == "source":
+            v = (r.get("meta") or {}).get("source")
+        elif f.startswith("labels."):
+            v = (r.get("labels") or {}).get(f[7:]) or None
+            v = v[0] if isinstance(v, list) and v else v
+        else:
+            v = r.get(f)
+        parts.append(str(v) if v not in (None, "") else "-")
+    return "|".join(parts)
+
+def split(in_path, out_train, out_val, out_test, ratios=(0.8,0.1,0.1), seed=1337,
+          group_keys: Sequence[str] = GROUP_KEYS, stratify: Sequence[str] = ("source", "answer"),
+          report_path=None, tolerance=0.05, min_stratum=50):
+    """
+    Streaming, group-aware split of a JSONL file or shard dir. A row's split depends only on
+    its group key (so reruns, reordering and new data reproduce it, and groups never straddle
+    splits). Assignment is not stratified: the `stratify` fields only define the strata whose
+    realized proportions are counted and reported, with strata off `ratios` by more than
+    `tolerance` flagged. Outputs are files or shard dirs and are replaced on every run.
+    """
+    counts: Dict[str, Dict[str, int]] = {}
+    with open_jsonl_sink(out_train, replace=True) as tr, open_jsonl_sink(out_val, replace=True) as va, \
+         open_jsonl_sink(out_test, replace=True) as te:
+        sinks = {"train": tr, "val": va, "test": te}
+        for p in list_jsonl(in_path):
+            for r in read_jsonl(p):
+                s = assign(group_key(r, group_keys), ratios, seed)
+                r["split"] = s
+                sinks[s].write(r)
+                c = counts.setdefault(stratum(r, stratify), dict.fromkeys(SPLITS, 0))
+                c[s] += 1
+    total = {s: sum(c[s] for c in counts.values()) for s in SPLITS}
+    skewed = []
+    for name, c in counts.items():
+        n = sum(c.values())
+        if n >= min_stratum and any(abs(c[s] / n - q) > tolerance for s, q in zip(SPLITS, ratios)):
+            skewed.append(name)
+    save_json(report_path or os.path.join(os.path.dirname(out_train) or ".", "split_report.json"),
+              {"ratios": list(ratios), "seed": seed, "group_keys": list(group_keys), "stratify": list(stratify),
+               "total": total, "strata": counts, "skewed": skewed})
+    log.info(f"Split: train={total['train']} val={total['val']} test={total['test']} ({len(counts)} strata)")
+    if skewed:
+        log.warning(f"{len(skewed)} strata deviate > {tolerance:.0%} from {ratios} (few large groups?): {skewed[:10]}")
+
+def _ratios(s: str) -> Tuple[float, float, float]:
+    r = tuple(float(x) for x in s.split(","))
+    if len(r) != 3 or abs(sum(r) - 1) > 1e-6:
+        raise ValueError(f"--ratios must be three comma-separated fractions summing to 1, got {s}")
+    return r
 
 if __name__ == "__main__":
     import argparse
     ap = argparse.ArgumentParser()
-    ap.add_argument("--in_path", required=True)
-    ap.add_argument("--out_train", required=True)
+    ap.add_argument("--in_path", required=True, help="JSONL file or shard dir")
+    ap.add_argument("--out_train", required=True, help="Output file (.jsonl[.gz|.zst]) or shard dir")
     ap.add_argument("--out_val", required=True)
     ap.add_argument("--out_test", required=True)
+    ap.add_argument("--ratios", type=_ratios, default=(0.8, 0.1, 0.1))
+    ap.add_argument("--seed", type=int, default=1337)
+    ap.add_argument("--group_keys", nargs="+", default=list(GROUP_KEYS), help="meta fields, first present wins")
+    ap.add_argument("--stratify", nargs="+", default=["source", "answer"],
+                    help="Fields whose per-value split proportions are reported (not used for assignment): "
+                         "'source', 'labels.<name>' or a row field")
     split(**vars(ap.parse_args()))
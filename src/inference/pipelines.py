@@ -29,8 +29,9 @@ class Pipeline:
     def __init__(self, index_dir: str, top_k: int = 5):
         cfg = load_config()
         inf = cfg.main.get("inference", {})
+        rag = cfg.main.get("rag", {})
         self.top_k = top_k
-        self.retriever = Retriever(index_dir, top_k=top_k)
+        self.retriever = Retriever(index_dir, top_k=top_k, nprobe=rag.get("nprobe"), ef_search=rag.get("ef_search"))
         self.llm = OrphLLM(inf.get("model_dir","./out/text_orphgpt"), device=inf.get("device","auto"))
         self.gen_args = {
             "max_new_tokens": inf.get("max_new_tokens", 256),
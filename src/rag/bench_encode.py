@@ -0,0 +1,57 @@
+import os, time, argparse
+from itertools import islice
+from typing import List
+from tabulate import tabulate
+from sentence_transformers import SentenceTransformer
+from src.rag.index_builder import ChunkEncoder, _passages
+from src.utils.io import list_jsonl, save_json
+from src.utils.logger import get_logger
+log = get_logger("rag")
+
+"""
+Index-build encoding throughput: passages/sec for each worker count × bucket strategy
+("none" = corpus order, "sorted" = length-sorted chunk, order restored) on a corpus sample.
+"""
+
+def _worker_counts(cpus: int) -> List[int]:
+    out, w = [], 1
+    while w < cpus:
+        out.append(w)
+        w *= 2
+    return out + [cpus]
+
+def bench(corpus_paths, model_name="sentence-transformers/all-MiniLM-L6-v2", n=4096, batch_size=256,
+          workers: List[int] = None, out_json="data/artifacts/bench/encode.json"):
+    paths = [p for c in corpus_paths for p in list_jsonl(c)]
+    texts = [p["text"] for _, _, p in islice(_passages(paths, 0, 0), n)]
+    enc = SentenceTransformer(model_name)
+    enc.encode(texts[:batch_size], batch_size=batch_size, show_progress_bar=False)  # warm-up
+    rows = []
+    for w in workers or _worker_counts(os.cpu_count() or 1):
+        for bucket in (False, True):
+            encode = ChunkEncoder(enc, batch_size, w, bucket)
+            try:
+                t0 = time.perf_counter()
+                encode(texts)
+                dt = time.perf_counter() - t0
+            finally:
+                encode.close()
+            rows.append({"workers": w, "bucket": "sorted" if bucket else "none", "passages": len(texts),
+                         "seconds": round(dt, 3), "passages_per_s": round(len(texts) / dt, 1)})
+            log.info(f"workers={w} bucket={rows[-1]['bucket']}: {rows[-1]['passages_per_s']} passages/s")
+    print(tabulate([[r["workers"], r["bucket"], r["passages"], r["seconds"], r["passages_per_s"]] for r in rows],
+                   headers=["Workers", "Bucket", "N", "Seconds", "Passages/s"], tablefmt="github"))
+    save_json(out_json, {"model": model_name, "batch_size": batch_size, "cpus": os.cpu_count(), "results": rows})
+    log.info(f"Wrote {out_json}")
+    return rows
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("corpus", nargs="+", help="Corpus JSONL files or shard dirs")
+    ap.add_argument("--model_name", default="sentence-transformers/all-MiniLM-L6-v2")
+    ap.add_argument("--n", type=int, default=4096, help="Passages to encode per configuration")
+    ap.add_argument("--batch_size", type=int, default=256)
+    ap.add_argument("--workers", type=int, nargs="+", default=None, help="Default: 1, 2, 4, ... up to all cores")
+    ap.add_argument("--out_json", default="data/artifacts/bench/encode.json")
+    args = ap.parse_args()
+    bench(args.corpus, args.model_name, args.n, args.batch_size, args.workers, args.out_json)
@@ -0,0 +1,94 @@
+import os, time, argparse
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+from tabulate import tabulate
+from src.rag.faiss_index import FACTORY, index_params, build_spec, make_index, populate, set_search_params
+from src.rag.index_builder import EMB, CKPT
+from src.utils.io import load_json, save_json
+from src.utils.logger import get_logger
+log = get_logger("rag")
+
+"""
+Index-type benchmark on a built RAG store's embeddings.f32. nq rows are held out as queries,
+each index type is built over (a sample of) the rest, and every nprobe / efSearch setting is
+reported as recall@k against exact flat search, p50/p99 single-query latency and serialized
+index size. Build parameters come from the orph.yaml `rag` section.
+"""
+
+NPROBE = (1, 4, 8, 16, 32, 64, 128)
+EF_SEARCH = (16, 32, 64, 128, 256)
+
+def _sweep(idx: faiss.Index) -> List[Dict[str, int]]:
+    ivf = faiss.try_extract_index_ivf(idx)
+    if ivf is not None:
+        return [{"nprobe": p} for p in NPROBE if p <= ivf.nlist]
+    if getattr(faiss.downcast_index(idx), "hnsw", None) is not None:
+        return [{"ef_search": e} for e in EF_SEARCH]
+    return [{}]
+
+def _latencies(idx: faiss.Index, Q: np.ndarray, k: int):
+    I = np.empty((len(Q), k), dtype=np.int64)
+    ms = np.empty(len(Q))
+    for i in range(len(Q)):
+        t0 = time.perf_counter()
+        _, I[i:i + 1] = idx.search(Q[i:i + 1], k)
+        ms[i] = (time.perf_counter() - t0) * 1e3
+    return I, ms
+
+def recall_at_k(I: np.ndarray, gt: np.ndarray) -> float:
+    k = gt.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(I.tolist(), gt.tolist())]))
+
+def bench(rag_dir: str, indexes: List[str], rag_cfg: Optional[Dict] = None, n: int = 1_000_000, nq: int = 1000,
+          k: int = 10, threads: int = 1, seed: int = 1337, out_json="data/artifacts/bench/index.json"):
+    ck = load_json(os.path.join(rag_dir, CKPT))
+    X = np.memmap(os.path.join(rag_dir, EMB), dtype=np.float32, mode="r").reshape(ck["n"], -1)
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(len(X))
+    Q = np.ascontiguousarray(X[np.sort(perm[:nq])])
+    B = np.ascontiguousarray(X[np.sort(perm[nq:nq + n])])
+    dim = X.shape[1]
+    faiss.omp_set_num_threads(threads)   # per-query latency as served: one query, `threads` threads
+    log.info(f"{len(B)} base vectors, {len(Q)} queries, dim={dim}, k={k}")
+
+    flat = faiss.IndexFlatIP(dim)
+    flat.add(B)
+    gt, _ = _latencies(flat, Q, k)
+    rows = []
+    for name in indexes:
+        spec = build_spec(index_params(rag_cfg, index=name), len(B))
+        t0 = time.perf_counter()
+        idx = populate(make_index(dim, spec), B, spec)
+        build_s = time.perf_counter() - t0
+        size = len(faiss.serialize_index(idx))
+        for params in _sweep(idx):
+            set_search_params(idx, **params)
+            I, ms = _latencies(idx, Q, k)
+            rows.append({"index": name, "factory": FACTORY[name].format(**spec), "params": params,
+                         f"recall@{k}": round(recall_at_k(I, gt), 4), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                         "p99_ms": round(float(np.percentile(ms, 99)), 3), "size_mb": round(size / 2**20, 2),
+                         "build_s": round(build_s, 2)})
+            log.info(f"{name} {params}: recall@{k}={rows[-1][f'recall@{k}']} p50={rows[-1]['p50_ms']}ms")
+    print(tabulate([[r["index"], " ".join(f"{a}={b}" for a, b in r["params"].items()) or "-", r[f"recall@{k}"],
+                     r["p50_ms"], r["p99_ms"], r["size_mb"], r["build_s"]] for r in rows],
+                   headers=["Index", "Search", f"Recall@{k}", "p50 ms", "p99 ms", "Size MB", "Build s"],
+                   tablefmt="github"))
+    save_json(out_json, {"rag_dir": rag_dir, "n_base": len(B), "n_queries": len(Q), "dim": dim, "k": k,
+                         "threads": threads, "results": rows})
+    log.info(f"Wrote {out_json}")
+    return rows
+
+if __name__ == "__main__":
+    from src.utils.config import load_config
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rag_dir", default="data/artifacts/rag", help="Output dir of src.rag.index_builder")
+    ap.add_argument("--indexes", nargs="+", choices=sorted(FACTORY), default=sorted(FACTORY))
+    ap.add_argument("--n", type=int, default=1_000_000, help="Base vectors sampled from the store")
+    ap.add_argument("--nq", type=int, default=1000, help="Held-out query vectors")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--threads", type=int, default=1, help="FAISS threads per query")
+    ap.add_argument("--out_json", default="data/artifacts/bench/index.json")
+    args = ap.parse_args()
+    bench(args.rag_dir, args.indexes, load_config().main.get("rag", {}), args.n, args.nq, args.k, args.threads,
+          out_json=args.out_json)
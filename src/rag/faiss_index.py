@@ -0,0 +1,82 @@
+from typing import Any, Dict, Optional
+import faiss
+import numpy as np
+from src.utils.logger import get_logger
+log = get_logger("rag")
+
+"""
+FAISS index selection for the RAG store, driven by the `rag` section of orph.yaml.
+All types use inner product on L2-normalized embeddings (= cosine):
+  flat      exact scan (baseline)
+  ivf_flat  inverted lists over full vectors; nprobe lists scanned per query
+  ivf_pq    inverted lists + product quantization (pq_m bytes/vector at 8 bits); the one for 10M+ passages
+  ivf_sq8   inverted lists + 8-bit scalar quantization
+  hnsw      graph index, no training; efSearch candidates per query
+  sq8/fp16  exact scan over 8-bit / half-precision vectors (4x / 2x smaller)
+"""
+
+FACTORY = {
+    "flat": "Flat",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}x{pq_bits}",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "hnsw": "HNSW{hnsw_m},Flat",
+    "sq8": "SQ8",
+    "fp16": "SQfp16",
+}
+DEFAULTS = {"index": "flat", "nlist": 4096, "pq_m": 48, "pq_bits": 8, "hnsw_m": 32, "ef_construction": 200,
+            "train_size": 262144, "nprobe": 32, "ef_search": 64}
+SEARCH_KEYS = ("nprobe", "ef_search")   # query-time only; changing them needs no rebuild
+MIN_POINTS_PER_LIST = 39                # below this FAISS k-means warns and clusters poorly
+
+def index_params(rag_cfg: Optional[Dict[str, Any]] = None, **overrides) -> Dict[str, Any]:
+    """DEFAULTS updated from the orph.yaml `rag` section and explicit (non-None) overrides."""
+    p = dict(DEFAULTS)
+    p.update({k: v for k, v in (rag_cfg or {}).items() if k in DEFAULTS})
+    p.update({k: v for k, v in overrides.items() if v is not None})
+    if p["index"] not in FACTORY:
+        raise ValueError(f"rag.index must be one of {sorted(FACTORY)}, got {p['index']!r}")
+    return p
+
+def build_spec(params: Dict[str, Any], n: int) -> Dict[str, Any]:
+    """Build-time parameters for n vectors (nlist capped so every list gets enough training points)."""
+    spec = {k: v for k, v in params.items() if k not in SEARCH_KEYS}
+    if "{nlist}" in FACTORY[spec["index"]]:
+        nlist = min(spec["nlist"], max(1, n // MIN_POINTS_PER_LIST))
+        if nlist < spec["nlist"]:
+            log.warning(f"nlist {spec['nlist']} too large for {n} vectors; using {nlist}")
+        spec["nlist"] = nlist
+    return spec
+
+def make_index(dim: int, spec: Dict[str, Any]) -> faiss.Index:
+    idx = faiss.index_factory(dim, FACTORY[spec["index"]].format(**spec), faiss.METRIC_INNER_PRODUCT)
+    hnsw = getattr(faiss.downcast_index(idx), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efConstruction = spec["ef_construction"]
+    return idx
+
+def train_sample(X: np.ndarray, size: int, seed: int = 1337) -> np.ndarray:
+    """Up to `size` rows of X (a memmap is fine; rows are read in file order)."""
+    if len(X) <= size:
+        return np.ascontiguousarray(X, dtype=np.float32)
+    rows = np.sort(np.random.default_rng(seed).choice(len(X), size, replace=False))
+    return np.ascontiguousarray(X[rows], dtype=np.float32)
+
+def populate(idx: faiss.Index, X: np.ndarray, spec: Dict[str, Any], chunk_size: int = 65536) -> faiss.Index:
+    """Train on a sample of X if the index type needs it, then add X in chunks."""
+    if not idx.is_trained:
+        sample = train_sample(X, spec["train_size"])
+        log.info(f"Training {spec['index']} on {len(sample)} vectors")
+        idx.train(sample)
+    for i in range(0, len(X), chunk_size):
+        idx.add(np.ascontiguousarray(X[i:i + chunk_size], dtype=np.float32))
+    return idx
+
+def set_search_params(idx: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """Apply query-time knobs where the index has them (no-op for flat/SQ)."""
+    ivf = faiss.try_extract_index_ivf(idx)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = getattr(faiss.downcast_index(idx), "hnsw", None)
+    if hnsw is not None and ef_search:
+        hnsw.efSearch = ef_search
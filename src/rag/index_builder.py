@@ -1,25 +1,167 @@
-import os, json, glob
+import os, json, argparse
+from itertools import islice
+from typing import Any, List, Iterator, Optional, Tuple, Dict
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from src.utils.io import read_jsonl, ensure_dir
+from src.rag.faiss_index import FACTORY, SEARCH_KEYS, index_params, build_spec, make_index, populate
+from src.utils.io import open_text, ensure_dir, list_jsonl, load_json, save_json_atomic, content_digest
 from src.utils.logger import get_logger
 log = get_logger("rag")
 
-def build_index(corpus_paths, out_dir, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+"""
+Streaming index build. Per chunk of passages: encode, append the float32 rows to
+`embeddings.f32` (memmap-able, shape (n, dim)), append {"text", "meta"} lines to `passages.jsonl`
+and their byte offsets to `passages.off` (int64), then save `checkpoint.json` (input position +
+file sizes). A crashed build truncates the files back to the last checkpoint and continues
+encoding from there. Once everything is encoded the FAISS index (type from the orph.yaml `rag`
+section, see faiss_index.py) is trained on a sample of the memmapped embeddings and filled from
+them, so switching index types later rebuilds only the index, not the embeddings.
+"""
+
+EMB, PASSAGES, OFFSETS, CKPT, INDEX = "embeddings.f32", "passages.jsonl", "passages.off", "checkpoint.json", "faiss.index"
+
+def _passages(paths: List[str], start_file: int, start_line: int) -> Iterator[Tuple[int, int, Dict]]:
+    """(file idx, lines consumed in that file, passage) from the given input position on."""
+    for fi in range(start_file, len(paths)):
+        with open_text(paths[fi], "rt") as f:
+            skip = start_line if fi == start_file else 0
+            for _ in islice(f, skip):
+                pass
+            n = skip
+            for line in f:
+                n += 1
+                if not line.strip(): continue
+                r = json.loads(line)
+                text = r.get("text") or ""
+                if not text: continue
+                meta = r.get("meta") or {}
+                yield fi, n, {"text": text[:2000], "meta": {"source": meta.get("source", "unknown"), "id": r.get("id"),
+                                                          "license": meta.get("license", "unknown")}}
+
+class ChunkEncoder:
+    """
+    SentenceTransformer encoding of one build chunk. With bucket=True the chunk is sorted by
+    length before batching (so batches pad to similar lengths) and the rows are put back in
+    input order after. workers > 1 uses the sentence-transformers multi-process pool on CPU,
+    one torch thread per worker so the processes do not oversubscribe the cores.
+    """
+    def __init__(self, enc: SentenceTransformer, batch_size: int = 256, workers: int = 1, bucket: bool = True):
+        self.enc, self.batch_size, self.bucket = enc, batch_size, bucket
+        self.pool = None
+        if workers > 1:
+            prev = os.environ.get("OMP_NUM_THREADS")
+            os.environ["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+            try:
+                self.pool = enc.start_multi_process_pool(target_devices=["cpu"] * workers)
+            finally:
+                if prev is None: os.environ.pop("OMP_NUM_THREADS", None)
+                else: os.environ["OMP_NUM_THREADS"] = prev
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        order = None
+        if self.bucket:
+            order = np.argsort(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)), kind="stable")
+            texts = [texts[i] for i in order]
+        if self.pool is not None:
+            X = self.enc.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        else:
+            X = self.enc.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+        X = np.asarray(X, dtype=np.float32)
+        if order is not None:
+            out = np.empty_like(X)
+            out[order] = X
+            X = out
+        return X
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.enc.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def _truncate(path: str, size: int) -> None:
+    with open(path, "ab") as f:
+        f.truncate(size)
+
+def build_index(corpus_paths, out_dir, model_name="sentence-transformers/all-MiniLM-L6-v2",
+                chunk_size: int = 8192, batch_size: int = 256, resume: bool = True, workers: int = 1,
+                bucket: bool = True, index_cfg: Optional[Dict[str, Any]] = None):
+    params = index_params(index_cfg)
+    build_params = {k: v for k, v in params.items() if k not in SEARCH_KEYS}
     ensure_dir(out_dir)
+    paths = [p for c in corpus_paths for p in list_jsonl(c)]
+    files = {k: os.path.join(out_dir, v) for k, v in
+             {"emb": EMB, "passages": PASSAGES, "off": OFFSETS, "ckpt": CKPT, "index": INDEX}.items()}
     enc = SentenceTransformer(model_name)
-    texts, metas = [], []
-    for p in corpus_paths:
-        for r in read_jsonl(p):
-            text = r.get("text") or ""
-            if not text: continue
-            texts.append(text[:2000])
-            metas.append({"source": r["meta"].get("source","unknown"), "id": r.get("id"), "license": r["meta"].get("license","unknown")})
-    log.info(f"Encoding {len(texts)} passages...")
-    X = enc.encode(texts, batch_size=256, convert_to_numpy=True, show_progress_bar=True)
-    idx = faiss.IndexFlatIP(X.shape[1]); faiss.normalize_L2(X); idx.add(X)
-    faiss.write_index(idx, os.path.join(out_dir, "faiss.index"))
-    with open(os.path.join(out_dir, "metas.json"), "w", encoding="utf-8") as f:
-        json.dump({"texts": texts, "metas": metas}, f)
-    log.info(f"Index saved → {out_dir}")
+    dim = enc.get_sentence_embedding_dimension()
+    # content digests, not just paths: a re-merge that rewrites part-NNNNN must not reuse or resume the old build
+    query = {"inputs": [[os.path.abspath(p), content_digest(p)] for p in paths], "model": model_name}
+    ck = load_json(files["ckpt"], {}) if resume else {}
+    if ck.get("query") != query:
+        ck = {"query": query, "file": 0, "line": 0, "n": 0, "passages_bytes": 0, "done": False}
+    if ck["done"] and ck.get("index") == build_params and os.path.exists(files["index"]):
+        log.info(f"Index already complete ({ck['n']} passages, {params['index']}) → {out_dir}")
+        return
+    for k, size in (("emb", ck["n"] * dim * 4), ("passages", ck["passages_bytes"]), ("off", ck["n"] * 8)):
+        _truncate(files[k], size)
+
+    if ck["n"] and not ck["done"]:
+        log.info(f"Resuming after {ck['n']} passages (file {ck['file']}, line {ck['line']})")
+
+    it = _passages(paths, ck["file"], ck["line"])
+    encode = ChunkEncoder(enc, batch_size, workers, bucket)
+    try:
+        with open(files["emb"], "ab") as emb_f, open(files["passages"], "ab") as pas_f, open(files["off"], "ab") as off_f:
+            while True:
+                chunk = list(islice(it, chunk_size))
+                if not chunk:
+                    break
+                X = encode([p["text"] for _, _, p in chunk])
+                faiss.normalize_L2(X)
+                X.tofile(emb_f)
+                offs = np.empty(len(chunk), dtype=np.int64)
+                pos = ck["passages_bytes"]
+                for i, (_, _, p) in enumerate(chunk):
+                    line = (json.dumps(p, ensure_ascii=False) + "\n").encode("utf-8")
+                    offs[i] = pos
+                    pos += len(line)
+                    pas_f.write(line)
+                offs.tofile(off_f)
+                for f in (emb_f, pas_f, off_f):
+                    f.flush()
+                    os.fsync(f.fileno())
+                ck.update({"file": chunk[-1][0], "line": chunk[-1][1], "n": ck["n"] + len(chunk), "passages_bytes": pos})
+                save_json_atomic(files["ckpt"], ck)
+                log.info(f"Encoded {ck['n']} passages")
+    finally:
+        encode.close()
+
+    spec = build_spec(params, ck["n"])
+    X = (np.memmap(files["emb"], dtype=np.float32, mode="r", shape=(ck["n"], dim)) if ck["n"]
+         else np.zeros((0, dim), dtype=np.float32))
+    idx = populate(make_index(dim, spec), X, spec, chunk_size)
+    del X
+    faiss.write_index(idx, files["index"] + ".tmp")
+    os.replace(files["index"] + ".tmp", files["index"])
+    ck.update({"done": True, "index": build_params, "index_spec": spec})
+    save_json_atomic(files["ckpt"], ck)
+    log.info(f"Index saved ({ck['n']} passages, dim={dim}, {spec['index']}) → {out_dir}")
+
+if __name__ == "__main__":
+    from src.utils.config import load_config
+    ap = argparse.ArgumentParser()
+    ap.add_argument("corpus", nargs="+", help="Corpus JSONL files or shard dirs")
+    ap.add_argument("--out_dir", default="data/artifacts/rag")
+    ap.add_argument("--model_name", default="sentence-transformers/all-MiniLM-L6-v2")
+    ap.add_argument("--chunk_size", type=int, default=8192, help="Passages per encode/checkpoint step")
+    ap.add_argument("--batch_size", type=int, default=256)
+    ap.add_argument("--fresh", action="store_true", help="Ignore checkpoint.json and rebuild")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Encoding processes (CPU)")
+    ap.add_argument("--no_bucket", dest="bucket", action="store_false", help="Batch in corpus order")
+    ap.add_argument("--index", choices=sorted(FACTORY), default=None, help="Index type (default: rag.index)")
+    args = ap.parse_args()
+    index_cfg = dict(load_config().main.get("rag", {}))
+    if args.index:
+        index_cfg["index"] = args.index
+    build_index(args.corpus, args.out_dir, args.model_name, args.chunk_size, args.batch_size,
+                resume=not args.fresh, workers=args.workers, bucket=args.bucket, index_cfg=index_cfg)
@@ -1,15 +1,35 @@
-import os, json
+import os, json, mmap
 import faiss, numpy as np
 from sentence_transformers import SentenceTransformer
+from src.rag.faiss_index import set_search_params
 
 class Retriever:
-    def __init__(self, index_dir, model_name="sentence-transformers/all-MiniLM-L6-v2", top_k=5):
+    def __init__(self, index_dir, model_name="sentence-transformers/all-MiniLM-L6-v2", top_k=5,
+                 nprobe=None, ef_search=None):
         self.top_k = top_k
         self.model = SentenceTransformer(model_name)
         self.index = faiss.read_index(os.path.join(index_dir, "faiss.index"))
-        with open(os.path.join(index_dir, "metas.json"), "r", encoding="utf-8") as f:
-            store = json.load(f)
-        self.texts = store["texts"]; self.metas = store["metas"]
+        set_search_params(self.index, nprobe, ef_search)  # IVF / HNSW recall-vs-latency knobs
+        legacy = os.path.join(index_dir, "metas.json")
+        if os.path.exists(os.path.join(index_dir, "passages.jsonl")) or not os.path.exists(legacy):
+            # streaming builder layout: passages read lazily by byte offset from a read-only mmap,
+            # which (unlike seek + readline on a shared handle) is safe across request threads
+            self.offsets = np.fromfile(os.path.join(index_dir, "passages.off"), dtype=np.int64)
+            with open(os.path.join(index_dir, "passages.jsonl"), "rb") as f:
+                self._passages = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+            self.texts = self.metas = None
+        else:
+            with open(legacy, "r", encoding="utf-8") as f:
+                store = json.load(f)
+            self.texts = store["texts"]; self.metas = store["metas"]
+
+    def passage(self, idx: int):
+        if self.texts is not None:
+            return self.texts[idx], self.metas[idx]
+        start = int(self.offsets[idx])
+        end = int(self.offsets[idx + 1]) if idx + 1 < len(self.offsets) else len(self._passages)
+        p = json.loads(self._passages[start:end])
+        return p["text"], p["meta"]
 
     def search(self, query: str):
         q = self.model.encode([query], convert_to_numpy=True)
@@ -18,5 +38,6 @@ class Retriever:
         hits = []
         for score, idx in zip(D[0].tolist(), I[0].tolist()):
             if idx == -1: continue
-            hits.append({"score": float(score), "text": self.texts[idx], "meta": self.metas[idx]})
+            text, meta = self.passage(idx)
+            hits.append({"score": float(score), "text": text, "meta": meta})
         return hits
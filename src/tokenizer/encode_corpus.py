@@ -0,0 +1,140 @@
+import argparse, os, hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import sentencepiece as spm
+from src.utils.io import read_jsonl, list_jsonl, load_json, save_json_atomic
+from src.utils.logger import get_logger
+log = get_logger("tokenizer")
+
+"""
+Encodes cleaned corpus shards with the trained SentencePiece model into flat token arrays:
+  <name>.bin      tokens (uint16 if the vocab fits, else uint32), each doc followed by EOS
+  <name>.off.npy  int64 doc start offsets into .bin, length n_docs + 1
+  <name>.src.npy  uint16 source id per doc (index into index.json "sources")
+index.json records dtype, model hash, the source table and one entry per input shard;
+shards whose input and model are unchanged are skipped on rerun.
+"""
+
+INDEX = "index.json"
+_sp: Optional[spm.SentencePieceProcessor] = None
+
+def _processor(model_path: str) -> spm.SentencePieceProcessor:
+    global _sp
+    if _sp is None:
+        _sp = spm.SentencePieceProcessor(model_file=model_path)
+    return _sp
+
+def token_dtype(vocab_size: int):
+    return np.uint16 if vocab_size <= 1 << 16 else np.uint32
+
+def _name(in_path: str) -> str:
+    stem = os.path.basename(in_path).split(".")[0]
+    return f"{os.path.basename(os.path.dirname(os.path.abspath(in_path)))}.{stem}"
+
+def _fingerprint(path: str, model_sha: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}:{model_sha[:16]}"
+
+def encode_shard(in_path: str, out_dir: str, model_path: str, batch: int = 512) -> Dict:
+    """One input shard → <name>.bin/.off.npy/.src.npy (via tmp files). Source ids are shard-local here."""
+    sp = _processor(model_path)
+    dtype = token_dtype(sp.get_piece_size())
+    eos = sp.eos_id()
+    name = _name(in_path)
+    bin_path = os.path.join(out_dir, f"{name}.bin")
+    offsets, src_ids, sources = [0], [], {}
+    rows = read_jsonl(in_path)
+    with open(bin_path + ".tmp", "wb") as f:
+        while True:
+            block = list(islice(rows, batch))
+            if not block:
+                break
+            block = [r for r in block if r.get("text")]
+            if not block:
+                continue
+            ids = sp.encode([r["text"] for r in block])
+            for r, toks in zip(block, ids):
+                toks.append(eos)
+                offsets.append(offsets[-1] + len(toks))
+                src = (r.get("meta") or {}).get("source", "unknown")
+                src_ids.append(sources.setdefault(src, len(sources)))
+            np.concatenate([np.asarray(toks, dtype=dtype) for toks in ids]).tofile(f)
+    os.replace(bin_path + ".tmp", bin_path)
+    np.save(os.path.join(out_dir, f"{name}.off.npy"), np.asarray(offsets, dtype=np.int64))
+    return {"input": in_path, "name": name, "n_docs": len(src_ids), "n_tokens": offsets[-1],
+            "local_src": np.asarray(src_ids, dtype=np.uint16), "local_sources": list(sources)}
+
+def encode_corpus(inputs: List[str], out_dir: str, model_path: str, workers: int = 1, batch: int = 512) -> Dict:
+    os.makedirs(out_dir, exist_ok=True)
+    with open(model_path, "rb") as f:
+        model_sha = hashlib.sha256(f.read()).hexdigest()
+    vocab = _processor(model_path).get_piece_size()
+    index = load_json(os.path.join(out_dir, INDEX), {})
+    if index.get("model_sha256") != model_sha:
+        index = {"model_sha256": model_sha, "vocab_size": vocab, "dtype": np.dtype(token_dtype(vocab)).name,
+                 "sources": [], "shards": {}}
+    shards = [p for i in inputs for p in list_jsonl(i)]
+    todo = [p for p in shards if index["shards"].get(_name(p), {}).get("fingerprint") != _fingerprint(p, model_sha)
+            or not os.path.exists(os.path.join(out_dir, f"{_name(p)}.bin"))]
+    log.info(f"Encoding {len(todo)} of {len(shards)} shards ({len(shards) - len(todo)} unchanged)")
+    args = ([out_dir] * len(todo), [model_path] * len(todo), [batch] * len(todo))
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = ex.map(encode_shard, todo, *args)
+            _record(results, index, out_dir, model_sha)
+    else:
+        _record(map(encode_shard, todo, *args), index, out_dir, model_sha)
+    tokens = sum(s["n_tokens"] for s in index["shards"].values())
+    log.info(f"{len(index['shards'])} shards, {tokens:,} tokens ({index['dtype']}) → {out_dir}")
+    return index
+
+def _record(results, index: Dict, out_dir: str, model_sha: str) -> None:
+    """Map shard-local source ids onto the append-only global table and save the index per shard."""
+    for res in results:
+        table = index["sources"]
+        for s in res["local_sources"]:
+            if s not in table:
+                table.append(s)
+        remap = np.asarray([table.index(s) for s in res["local_sources"]] or [0], dtype=np.uint16)
+        np.save(os.path.join(out_dir, f"{res['name']}.src.npy"), remap[res["local_src"]])
+        index["shards"][res["name"]] = {"input": res["input"], "fingerprint": _fingerprint(res["input"], model_sha),
+                                        "n_docs": res["n_docs"], "n_tokens": res["n_tokens"]}
+        save_json_atomic(os.path.join(out_dir, INDEX), index)
+        log.info(f"  {res['name']}: {res['n_docs']} docs, {res['n_tokens']:,} tokens")
+
+class TokenShards:
+    """Read side: memory-mapped token shards; docs are zero-copy slices."""
+    def __init__(self, out_dir: str):
+        self.index = load_json(os.path.join(out_dir, INDEX))
+        self.sources: List[str] = self.index["sources"]
+        dtype = np.dtype(self.index["dtype"])
+        self.tokens, self.offsets, self.src = [], [], []
+        for name in sorted(self.index["shards"]):
+            n = self.index["shards"][name]["n_tokens"]  # np.memmap cannot map an empty file
+            self.tokens.append(np.memmap(os.path.join(out_dir, f"{name}.bin"), dtype=dtype, mode="r")
+                               if n else np.zeros(0, dtype=dtype))
+            self.offsets.append(np.load(os.path.join(out_dir, f"{name}.off.npy"), mmap_mode="r"))
+            self.src.append(np.load(os.path.join(out_dir, f"{name}.src.npy"), mmap_mode="r"))
+        self._starts = np.cumsum([0] + [len(o) - 1 for o in self.offsets])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, int]:
+        """(tokens incl. EOS, source id) of doc i."""
+        s = int(np.searchsorted(self._starts, i, side="right")) - 1
+        j = i - self._starts[s]
+        off = self.offsets[s]
+        return self.tokens[s][off[j]:off[j + 1]], int(self.src[s][j])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--inputs", nargs="+", default=["data/cleaned/text_corpus"], help="JSONL files or shard dirs")
+    ap.add_argument("--model", default="data/artifacts/tokenizer/orph_spm.model")
+    ap.add_argument("--out_dir", default="data/artifacts/tokens")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=512, help="Docs per SentencePiece encode call")
+    args = ap.parse_args()
+    encode_corpus(args.inputs, args.out_dir, args.model, args.workers, args.batch)
@@ -1,24 +1,122 @@
-import argparse, sentencepiece as spm, os, tempfile
-from src.utils.io import read_jsonl
+import argparse, os, time, heapq, random, zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import sentencepiece as spm
+from src.utils.io import read_jsonl, list_jsonl
 from src.utils.logger import get_logger
 log = get_logger("tokenizer")
 
-def write_corpus_txt(jsonl_path: str, out_txt: str, max_lines: int|None):
-    n=0
+def _sample_shard(path: str, k: int, weights: Dict[str, float], seed: int,
+                  floor: float = 0.0) -> Tuple[List[Tuple[float, str]], Dict[str, int], int]:
+    """
+    Weighted reservoir sample (A-Res: key = u ** (1 / w), keep the k largest) of one shard's texts.
+    Keys are comparable across shards, so the k largest over all shards' reservoirs is an exact
+    sample of the whole corpus. Keys <= `floor` (the caller's current k-th largest) cannot make
+    the final sample and are not returned. Returns (reservoir, rows seen per source, text bytes seen).
+    """
+    name = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+    rng = random.Random(zlib.crc32(f"{seed}:{name}".encode("utf-8")))
+    heap: List[Tuple[float, str]] = []
+    seen: Dict[str, int] = {}
+    nbytes = 0
+    for r in read_jsonl(path):
+        t = r.get("text") or ""
+        if not t: continue
+        src = (r.get("meta") or {}).get("source", "unknown")
+        seen[src] = seen.get(src, 0) + 1
+        nbytes += len(t)
+        w = weights.get(src, weights.get("*", 1.0))
+        if w <= 0: continue
+        key = rng.random() ** (1.0 / w)
+        if key <= floor: continue
+        if len(heap) < k:
+            heapq.heappush(heap, (key, t))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, t))
+    return heap, seen, nbytes
+
+def sample_corpus(inputs: List[str], k: int, weights: Optional[Dict[str, float]] = None, seed: int = 1337,
+                  workers: int = 1) -> List[str]:
+    """
+    k texts sampled across every shard of `inputs` (uniformly, or per-source `weights`), shards in
+    parallel. Shard reservoirs are folded into one k-sized min-heap as they arrive, with at most
+    2 * workers shards in flight, and each shard is told the heap's current minimum so it only
+    returns texts that can still get in.
+    """
+    shards = [p for i in inputs for p in list_jsonl(i)]
+    weights = weights or {}
+    t0 = time.time()
+    heap: List[Tuple[float, str]] = []
+    seen: Dict[str, int] = {}
+    nbytes = 0
+
+    def floor() -> float:
+        return heap[0][0] if len(heap) >= k else 0.0
+
+    def fold(result) -> None:
+        nonlocal nbytes
+        res, s, b = result
+        for x in res:
+            if len(heap) < k:
+                heapq.heappush(heap, x)
+            else:
+                heapq.heappushpop(heap, x)
+        for src, n in s.items():
+            seen[src] = seen.get(src, 0) + n
+        nbytes += b
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            pending: deque = deque()
+            for p in shards:
+                pending.append(ex.submit(_sample_shard, p, k, weights, seed, floor()))
+                if len(pending) >= 2 * workers:
+                    fold(pending.popleft().result())
+            while pending:
+                fold(pending.popleft().result())
+    else:
+        for p in shards:
+            fold(_sample_shard(p, k, weights, seed, floor()))
+    sample = sorted(heap, reverse=True)
+    dt = max(time.time() - t0, 1e-9)
+    rows = sum(seen.values())
+    log.info(f"Sampled {len(sample)} of {rows} docs from {len(shards)} shards in {dt:.1f}s "
+             f"({rows / dt:,.0f} docs/s, {nbytes / dt / 1e6:.1f} MB/s)")
+    log.info(f"Seen per source: {seen}")
+    return [t for _, t in sample]
+
+class _Sentences:
+    """Lines of the sampled docs, counted for the throughput report."""
+    def __init__(self, docs: List[str]):
+        self.docs, self.lines, self.bytes = docs, 0, 0
+
+    def __iter__(self) -> Iterator[str]:
+        for d in self.docs:
+            for line in d.split("\n"):
+                line = line.strip()
+                if not line: continue
+                self.lines += 1
+                self.bytes += len(line)
+                yield line
+
+def write_corpus_txt(jsonl_path: str, out_txt: str, max_lines: int|None, workers: int = 1):
+    """Sampled corpus as a text file, for inspection or external tools (training does not need it)."""
+    n = 0
     with open(out_txt, "w", encoding="utf-8") as f:
-        for r in read_jsonl(jsonl_path):
-            t = r.get("text") or ""
-            if not t: continue
-            f.write(t.replace("\n"," ") + "\n")
+        for line in _Sentences(sample_corpus([jsonl_path], max_lines or 2_000_000, workers=workers)):
+            f.write(line + "\n")
             n += 1
-            if max_lines and n >= max_lines: break
     log.info(f"Tokenizer corpus lines: {n}")
 
-def train_spm(corpus_txt: str, out_dir: str, vocab_size: int, model_type: str):
+def train_spm(corpus: Iterable[str] | str, out_dir: str, vocab_size: int, model_type: str):
+    """Train from a text file path or, without touching disk, from an iterable of sentences."""
     os.makedirs(out_dir, exist_ok=True)
     model_prefix = os.path.join(out_dir, "orph_spm")
+    src = {"input": corpus} if isinstance(corpus, str) else {"sentence_iterator": iter(corpus)}
+    t0 = time.time()
     spm.SentencePieceTrainer.Train(
-        input=corpus_txt,
+        **src,
         model_prefix=model_prefix,
         vocab_size=vocab_size,
         model_type=model_type,     # bpe | unigram
@@ -27,18 +125,31 @@ def train_spm(corpus_txt: str, out_dir: str, vocab_size: int, model_type: str):
         shuffle_input_sentence=True,
         pad_id=0, unk_id=1, bos_id=2, eos_id=3
     )
+    dt = time.time() - t0
+    if isinstance(corpus, _Sentences):
+        log.info(f"Trained on {corpus.lines} lines / {corpus.bytes / 1e6:.1f} MB in {dt:.1f}s "
+                 f"({corpus.bytes / dt / 1e6:.2f} MB/s)")
     log.info(f"Saved tokenizer to {model_prefix}.model / .vocab")
 
+def _weights(items: List[str]) -> Dict[str, float]:
+    out = {}
+    for it in items:
+        k, _, v = it.partition("=")
+        out[k] = float(v)
+    return out
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("--jsonl", default="data/cleaned/text_corpus.jsonl")
+    ap.add_argument("--jsonl", nargs="+", default=["data/cleaned/text_corpus"], help="Corpus JSONL files or shard dirs")
     ap.add_argument("--out_dir", default="data/artifacts/tokenizer")
     ap.add_argument("--vocab_size", type=int, default=48000)
     ap.add_argument("--model_type", default="bpe")
-    ap.add_argument("--max_lines", type=int, default=2_000_000)
+    ap.add_argument("--max_lines", type=int, default=2_000_000, help="Documents to sample")
+    ap.add_argument("--source_weights", nargs="*", default=[],
+                    help="source=weight pairs ('*' for the default, 0 excludes), e.g. pubmed=1 openfda=0.3")
+    ap.add_argument("--seed", type=int, default=1337)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
     args = ap.parse_args()
 
-    with tempfile.TemporaryDirectory() as td:
-        corpus_txt = os.path.join(td, "tok_corpus.txt")
-        write_corpus_txt(args.jsonl, corpus_txt, args.max_lines)
-        train_spm(corpus_txt, args.out_dir, args.vocab_size, args.model_type)
+    docs = sample_corpus(args.jsonl, args.max_lines, _weights(args.source_weights), args.seed, args.workers)
+    train_spm(_Sentences(docs), args.out_dir, args.vocab_size, args.model_type)
@@ -1,9 +1,34 @@
-import json, os, gzip
-from typing import Iterable, Dict, Any, Union
+import json, os, gzip, glob, hashlib, io, shutil
+from typing import Iterable, Dict, Any, Union, Optional, List
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+JSONL_EXTS = (".jsonl", ".jsonl.gz", ".jsonl.zst")
 
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
+def open_text(path: str, mode: str = "rt"):
+    """
+    open() that transparently handles .gz / .zst by extension (text modes only). Append mode
+    adds a new gzip member / zstd frame, which readers continue through.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstd is None:
+            raise ImportError("zstandard is required for .zst files: pip install zstandard")
+        raw = open(path, "rb" if "r" in mode else "ab" if "a" in mode else "wb")
+        if "r" in mode:
+            stream = zstd.ZstdDecompressor().stream_reader(raw, closefd=True, read_across_frames=True)
+        else:
+            stream = zstd.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
 def write_jsonl(path: str, rows: Iterable[Dict[str, Any]]):
     ensure_dir(os.path.dirname(path))
     with open(path, "w", encoding="utf-8") as f:
@@ -11,13 +36,421 @@ def write_jsonl(path: str, rows: Iterable[Dict[str, Any]]):
             f.write(json.dumps(r, ensure_ascii=False) + "\n")
 
 def read_jsonl(path: str):
-    open_fn = gzip.open if path.endswith(".gz") else open
-    with open_fn(path, "rt", encoding="utf-8") as f:
+    with open_text(path, "rt") as f:
         for line in f:
             if line.strip():
                 yield json.loads(line)
 
+def list_jsonl(path: str) -> List[str]:
+    """A single file, or every (optionally compressed) JSONL file/shard under a directory, sorted."""
+    if os.path.isfile(path):
+        return [path]
+    out = []
+    for ext in JSONL_EXTS:
+        out.extend(glob.glob(os.path.join(path, f"*{ext}")))
+    return sorted(p for p in out if ".tmp." not in os.path.basename(p))
+
+_DIGESTS: Dict[str, tuple] = {}
+
+def _manifest_digests(d: str) -> Dict[str, str]:
+    """file name -> sha256 from every ShardWriter manifest in directory d (cached per manifest version)."""
+    out: Dict[str, str] = {}
+    for m in glob.glob(os.path.join(d, "*manifest.json")):
+        st = os.stat(m)
+        stamp = (st.st_size, st.st_mtime_ns)
+        if _DIGESTS.get(m, (None,))[0] != stamp:
+            shards = load_json(m, {}).get("shards", [])
+            _DIGESTS[m] = (stamp, {e["file"]: e["sha256"] for e in shards if e.get("sha256")})
+        out.update(_DIGESTS[m][1])
+    return out
+
+def content_digest(path: str) -> str:
+    """
+    Content identity of a JSONL file: the sha256 its ShardWriter manifest records (free), else a
+    sha256 of the file's bytes. Unlike size+mtime it is unchanged when a file is rewritten with
+    the same content (e.g. by a re-merge in replace mode) and changes whenever the content does.
+    """
+    d, name = os.path.split(os.path.abspath(path))
+    sha = _manifest_digests(d).get(name)
+    if sha:
+        return sha
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return "file:" + h.hexdigest()
+
+_JSON_WS = " \t\n\r"
+_NUM_CHARS = frozenset("0123456789+-.eE")
+
+def iter_json_items(f, key: str = "results", chunk_size: int = 1 << 20):
+    """
+    Stream the elements of the top-level array `key` from a JSON object in text file `f`
+    (e.g. openFDA bulk exports: {"meta": {...}, "results": [...]}) without loading the
+    document. Other top-level values are decoded and discarded; memory is one element
+    plus one read chunk.
+    """
+    dec = json.JSONDecoder(strict=False)
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _JSON_WS:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                raise ValueError("unexpected end of JSON")
+            fill()
+
+    def value():
+        nonlocal pos
+        while True:
+            peek()
+            try:
+                obj, end = dec.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()  # value straddles the chunk boundary
+                continue
+            # a number running to the end of the buffer may be cut short, even if the decoder
+            # stopped early: "4444." decodes as 4444 with the "." left over
+            if not eof and isinstance(obj, (int, float)) and all(c in _NUM_CHARS for c in buf[end:]):
+                fill()
+                continue
+            pos = end
+            return obj
+
+    def expect(ch: str):
+        nonlocal pos
+        if peek() != ch:
+            raise ValueError(f"expected {ch!r} at offset {pos}, got {buf[pos]!r}")
+        pos += 1
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        k = value()
+        expect(":")
+        if k == key and peek() == "[":
+            pos += 1
+            if peek() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield value()
+                    if peek() == ",":
+                        pos += 1
+                        continue
+                    expect("]")
+                    break
+        else:
+            value()
+        if peek() == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
+
+def write_frame(writer: "ShardWriter", df, chunk_rows: int = 10000) -> int:
+    """Bulk-serialize a DataFrame of schema rows (one column per key) into a ShardWriter."""
+    n = 0
+    for i in range(0, len(df), chunk_rows):
+        block = df.iloc[i:i + chunk_rows].to_json(orient="records", lines=True, force_ascii=False)
+        writer.write_lines(block.splitlines())
+        n += min(chunk_rows, len(df) - i)
+    return n
+
+def scan_files(root: str, exts, recursive: bool = False) -> set:
+    """One directory listing → set of paths relative to root (forward slashes) with the given extensions."""
+    exts = tuple(e.lower() for e in exts)
+    out = set()
+    if recursive:
+        for dirpath, _, files in os.walk(root):
+            rel = os.path.relpath(dirpath, root).replace("\\", "/")
+            for fn in files:
+                if fn.lower().endswith(exts):
+                    out.add(fn if rel == "." else f"{rel}/{fn}")
+    elif os.path.isdir(root):
+        with os.scandir(root) as it:
+            out = {e.name for e in it if e.name.lower().endswith(exts)}
+    return out
+
 def save_json(path: str, obj: Union[dict, list]):
     ensure_dir(os.path.dirname(path))
     with open(path, "w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
+
+def save_json_atomic(path: str, obj: Union[dict, list]):
+    """save_json via tmp file + os.replace, so readers never see a half-written file."""
+    ensure_dir(os.path.dirname(path) or ".")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def load_json(path: str, default: Any = None) -> Any:
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class ShardWriter:
+    """
+    Rotating JSONL shard sink: `{prefix}-00000.jsonl[.zst|.gz]`, a new shard every `shard_size` rows.
+    Rows are buffered and written in blocks; each shard is written to `*.tmp` and renamed on close.
+    `manifest.json` in `out_dir` lists every committed shard (rows, bytes, sha256 of the
+    uncompressed JSONL) and is itself replaced atomically, so it only ever names complete shards.
+    Re-opening a directory continues numbering after the shards already in the manifest.
+    Independent writers (e.g. one per worker process) can share a directory by using
+    distinct prefixes and `manifest` file names.
+    With auto_rotate=False the caller decides when to rotate (see `full` / commit_shard),
+    e.g. to keep shard boundaries aligned with resumable checkpoints.
+    With replace=True the run produces a new shard set instead of appending: shards go to
+    `out_dir/.staging` (invisible to list_jsonl) and close() publishes them over the old set,
+    manifest last. resume_staging=True continues a staging dir left by an interrupted run
+    instead of clearing it.
+    """
+    MANIFEST = "manifest.json"
+    STAGING = ".staging"
+
+    def __init__(self, out_dir: str, prefix: str = "part", shard_size: int = 5000,
+                 compression: Optional[str] = "auto", buffer_rows: int = 512, auto_rotate: bool = True,
+                 manifest: Optional[str] = None, replace: bool = False, resume_staging: bool = False):
+        self.final_dir, self.replace = out_dir, replace
+        if replace:
+            out_dir = os.path.join(out_dir, self.STAGING)
+            if not resume_staging:
+                shutil.rmtree(out_dir, ignore_errors=True)
+        ensure_dir(out_dir)
+        if compression == "auto":
+            compression = "zst" if zstd is not None else "gz"
+        if compression not in (None, "zst", "gz"):
+            raise ValueError(f"Unknown compression: {compression}")
+        self.out_dir, self.prefix = out_dir, prefix
+        self.shard_size = max(1, int(shard_size))
+        self.compression = compression
+        self.buffer_rows = max(1, buffer_rows)
+        self.auto_rotate = auto_rotate
+        self.manifest_path = os.path.join(out_dir, manifest or self.MANIFEST)
+        self.manifest = load_json(self.manifest_path, {"shards": []})
+        self.shard_idx = len(self.manifest["shards"])
+        self.rows_total = 0
+        self._f = None
+        self._buf: List[str] = []
+        self._rows = 0
+        self._raw_bytes = 0
+        self._sha = None
+
+    @property
+    def ext(self) -> str:
+        return ".jsonl" + (f".{self.compression}" if self.compression else "")
+
+    def _shard_path(self, idx: int) -> str:
+        return os.path.join(self.out_dir, f"{self.prefix}-{idx:05d}{self.ext}")
+
+    def _open(self):
+        self._path = self._shard_path(self.shard_idx)
+        self._f = open_text(self._tmp_name(), "wt")
+        self._rows, self._raw_bytes, self._sha = 0, 0, hashlib.sha256()
+
+    def _tmp_name(self) -> str:
+        # keep the compression suffix last so open_text still picks the codec
+        return self._path[: -len(self.ext)] + ".tmp" + self.ext
+
+    def _flush(self):
+        if not self._buf:
+            return
+        block = "".join(self._buf)
+        data = block.encode("utf-8")
+        self._sha.update(data)
+        self._raw_bytes += len(data)
+        self._f.write(block)
+        self._buf.clear()
+
+    def write(self, row: Dict[str, Any]) -> None:
+        if self._f is None:
+            self._open()
+        self._buf.append(json.dumps(row, ensure_ascii=False) + "\n")
+        self._rows += 1
+        self.rows_total += 1
+        if len(self._buf) >= self.buffer_rows:
+            self._flush()
+        if self.auto_rotate and self.full:
+            self.commit_shard()
+
+    def write_lines(self, lines: Iterable[str]) -> None:
+        """Pre-serialized JSONL rows (one object per line, trailing newline optional)."""
+        for line in lines:
+            if self._f is None:
+                self._open()
+            self._buf.append(line if line.endswith("\n") else line + "\n")
+            self._rows += 1
+            self.rows_total += 1
+            if len(self._buf) >= self.buffer_rows:
+                self._flush()
+            if self.auto_rotate and self.full:
+                self.commit_shard()
+
+    @property
+    def full(self) -> bool:
+        return self._f is not None and self._rows >= self.shard_size
+
+    def commit_shard(self) -> Optional[Dict[str, Any]]:
+        """Close the open shard (if any), rename it into place and record it in the manifest."""
+        if self._f is None:
+            return None
+        self._flush()
+        self._f.close()
+        os.replace(self._tmp_name(), self._path)
+        entry = {
+            "file": os.path.basename(self._path),
+            "rows": self._rows,
+            "bytes": os.path.getsize(self._path),
+            "raw_bytes": self._raw_bytes,
+            "sha256": self._sha.hexdigest(),
+        }
+        self.manifest["shards"].append(entry)
+        save_json_atomic(self.manifest_path, self.manifest)
+        self._f = None
+        self.shard_idx += 1
+        return entry
+
+    @property
+    def last_shard(self) -> Optional[str]:
+        shards = self.manifest["shards"]
+        return shards[-1]["file"] if shards else None
+
+    def abort_shard(self) -> None:
+        """Drop the open (uncommitted) shard; committed shards and the manifest are untouched."""
+        if self._f is None:
+            return
+        self._buf.clear()
+        self._f.close()
+        try:
+            os.remove(self._tmp_name())
+        except OSError:
+            pass
+        self.rows_total -= self._rows
+        self._f = None
+
+    def publish(self) -> None:
+        """replace mode: make the staged shards the whole shard set of the target dir."""
+        staged = self.manifest_path
+        final = os.path.join(self.final_dir, os.path.basename(staged))
+        if not os.path.exists(staged):  # nothing committed: publish an empty set
+            save_json_atomic(staged, self.manifest)
+        new = {e["file"] for e in self.manifest["shards"]}
+        for e in load_json(final, {"shards": []})["shards"]:
+            if e["file"] not in new:
+                try:
+                    os.remove(os.path.join(self.final_dir, e["file"]))
+                except OSError:
+                    pass
+        for f in new:
+            os.replace(os.path.join(self.out_dir, f), os.path.join(self.final_dir, f))
+        os.replace(staged, final)
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def abort(self) -> None:
+        """Drop the open shard and, in replace mode, everything staged; the published set is untouched."""
+        self.abort_shard()
+        if self.replace:
+            shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def close(self) -> None:
+        self.commit_shard()
+        if self.replace and os.path.isdir(self.out_dir):
+            self.publish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.replace:
+            self.abort()
+        else:
+            self.close()
+
+class JsonlFile:
+    """Single-file counterpart of ShardWriter (same write / write_lines / close interface)."""
+    def __init__(self, path: str):
+        ensure_dir(os.path.dirname(path) or ".")
+        self.path = path
+        self.rows_total = 0
+        self._f = open_text(path, "wt")
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.rows_total += 1
+
+    def write_lines(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self._f.write(line if line.endswith("\n") else line + "\n")
+            self.rows_total += 1
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_jsonl_sink(path: str, **shard_kw) -> Union["JsonlFile", ShardWriter]:
+    """A JsonlFile when `path` has a JSONL extension, else a ShardWriter directory."""
+    if path.endswith(JSONL_EXTS):
+        return JsonlFile(path)
+    return ShardWriter(path, **shard_kw)
+
+def compact_shards(out_dir: str, key=lambda r: r.get("id"), manifest: str = ShardWriter.MANIFEST) -> int:
+    """
+    Upsert compaction over a ShardWriter directory: when `key` repeats, only the last
+    occurrence (manifest order, then line order) survives. Only shards holding a
+    superseded row are rewritten (tmp + rename) and their manifest entries refreshed.
+    Returns the number of rows dropped.
+    """
+    mpath = os.path.join(out_dir, manifest)
+    man = load_json(mpath, {"shards": []})
+    last: Dict[Any, tuple] = {}
+    stale: Dict[int, int] = {}
+    for si, ent in enumerate(man["shards"]):
+        for li, r in enumerate(read_jsonl(os.path.join(out_dir, ent["file"]))):
+            k = key(r)
+            if k is None:
+                continue
+            if k in last:
+                stale[last[k][0]] = stale.get(last[k][0], 0) + 1
+            last[k] = (si, li)
+    dropped = 0
+    for si in sorted(stale):
+        ent = man["shards"][si]
+        path = os.path.join(out_dir, ent["file"])
+        rows = [r for li, r in enumerate(read_jsonl(path))
+                if key(r) is None or last[key(r)] == (si, li)]
+        dropped += ent["rows"] - len(rows)
+        tmp = path[: -len(".jsonl")] + ".tmp.jsonl" if path.endswith(".jsonl") else path.replace(".jsonl.", ".tmp.jsonl.")
+        sha, raw = hashlib.sha256(), 0
+        with open_text(tmp, "wt") as f:
+            for r in rows:
+                line = json.dumps(r, ensure_ascii=False) + "\n"
+                data = line.encode("utf-8")
+                sha.update(data); raw += len(data)
+                f.write(line)
+        os.replace(tmp, path)
+        ent.update(rows=len(rows), bytes=os.path.getsize(path), raw_bytes=raw, sha256=sha.hexdigest())
+    if dropped:
+        save_json_atomic(mpath, man)
+    return dropped